@@ -0,0 +1,215 @@
+import json
+import optparse
+import os
+import subprocess
+import threading
+import time
+from typing import List, Optional
+
+import numpy as np
+
+from car_detection import (VEHICLE_CLASSES, StageTimings, Stream, load_config,
+                           run_streams)
+from detectors import load_detector
+
+# Replays recorded clips (videos, image directories or glob patterns) through the
+# same Stream/StreamThread path as live cameras and reports per-stage timings,
+# end-to-end latency, FPS per stream and counting accuracy as JSON.
+#
+# The annotation file maps clip paths, relative to the working directory, to an
+# optional ROI, motion/schedule settings as in a camera config and the expected counts:
+#   {"clips/day/clip1.mp4": {"roi": [[x, y], ...], "counts": {"car": 12, "bus": 1, "motorcycle": 4}}}
+# Clips without an ROI are counted over the full frame.
+
+
+# Stands in for DetectionSender and keeps every published event
+class RecordingSender:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.events = []
+        self.messages = 0
+
+    def publish(self, detections):
+        if detections:
+            with self.lock:
+                self.events.extend(detections)
+                self.messages += 1
+
+
+def summarize(samples: List[float]) -> dict:
+    if not samples:
+        return {"count": 0}
+    values = np.array(samples) * 1000
+    return {
+        "count": len(samples),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p90_ms": float(np.percentile(values, 90)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(values.max()),
+    }
+
+
+def counting_accuracy(counts: dict, expected: dict) -> dict:
+    errors = {name: counts.get(name, 0) - expected.get(name, 0) for name in VEHICLE_CLASSES}
+    total = sum(expected.get(name, 0) for name in VEHICLE_CLASSES)
+    absolute = sum(abs(error) for error in errors.values())
+    return {
+        "expected": {name: expected.get(name, 0) for name in VEHICLE_CLASSES},
+        "errors": errors,
+        "accuracy": max(0.0, 1 - absolute / total) if total else float(absolute == 0),
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(clips: List[str], detector_settings: dict, annotations: dict,
+                  fps: Optional[float] = None, capture_mode: str = "direct") -> dict:
+    streams = []
+    for i, path in enumerate(clips):
+        # Clips in different directories often share a file name
+        name = os.path.relpath(path)
+        annotation = annotations.get(name, {})
+        motion = annotation.get("motion", {})
+        stream = Stream(path, "file", name, [tuple(point) for point in annotation.get("roi", [])],
+                        capture_mode, motion=None if motion is False else motion,
+                        schedule=annotation.get("schedule", {}))
+        stream.camNumber = i % 4
+        stream.replay_fps = fps
+        stream.timings = StageTimings()
+        if not stream.roi_points:
+            ret, frame = stream.getFrame()
+            if not ret:
+                raise SystemExit(f"Can't read {path}")
+            height, width = frame.shape[:2]
+            stream.roi_points = [(0, 0), (width - 1, 0), (width - 1, height - 1), (0, height - 1)]
+            # Start the replay from the first frame again
+            if stream.cap is not None:
+                stream.cap.release()
+            stream.cap = stream.files = None
+            stream.file_index = 0
+            stream.timings = StageTimings()
+        streams.append(stream)
+
+    model = load_detector(detector_settings)
+    sender = RecordingSender()
+    options = optparse.Values({"headless": True})
+    start = time.perf_counter()
+    run_streams(streams, model, options, sender=sender)
+    elapsed = time.perf_counter() - start
+
+    results = {}
+    total_frames = 0
+    for stream in streams:
+        timings = stream.timings
+        frames = len(timings.samples["publish"])
+        total_frames += frames
+        duration = (timings.finished or 0) - (timings.started or 0)
+        counts = vars(stream.total_counts).copy()
+        results[stream.label] = {
+            "frames": frames,
+            "fps": frames / duration if duration > 0 else 0.0,
+            "dropped_frames": stream.dropped_frames,
+            "stages": {stage: summarize(timings.samples[stage]) for stage in StageTimings.STAGES
+                       if stage != "latency"},
+            "latency": summarize(timings.samples["latency"]),
+            "counts": counts,
+        }
+        if "counts" in annotations.get(stream.label, {}):
+            results[stream.label].update(counting_accuracy(counts, annotations[stream.label]["counts"]))
+
+    return {
+        "revision": git_revision(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "detector": detector_settings,
+        "replay_fps": fps,
+        "capture_mode": capture_mode,
+        "elapsed_s": elapsed,
+        "aggregate_fps": total_frames / elapsed if elapsed > 0 else 0.0,
+        "events": len(sender.events),
+        "streams": results,
+    }
+
+
+def get_options():
+    optParser = optparse.OptionParser(usage="%prog [options] CLIP [CLIP ...]")
+    optParser.add_option(
+        "-a",
+        "--annotations",
+        dest="annotations",
+        type="string",
+        default=None,
+        help="ground truth counts (and ROIs) per clip",
+    )
+    optParser.add_option(
+        "-c",
+        "--config",
+        dest="config",
+        type="string",
+        default=None,
+        help="take the detector settings from this camera config",
+    )
+    optParser.add_option(
+        "--backend",
+        dest="backend",
+        type="choice",
+        choices=["torch", "onnx"],
+        default=None,
+        help="detector backend",
+    )
+    optParser.add_option(
+        "--fps",
+        dest="fps",
+        type="float",
+        default=None,
+        help="replay rate per clip, unbounded by default",
+    )
+    optParser.add_option(
+        "--capture",
+        dest="capture_mode",
+        type="choice",
+        choices=["direct", "latest"],
+        default="direct",
+        help="capture mode of the streams (latest drops frames inference can't keep up with)",
+    )
+    optParser.add_option(
+        "-o",
+        dest="output",
+        type="string",
+        default="bench_output.json",
+        help="where to write the results",
+    )
+
+    options, args = optParser.parse_args()
+    if not args:
+        optParser.error("expected at least one clip")
+    return options, args
+
+
+# this is the main entry point of this script
+if __name__ == "__main__":
+    options, clips = get_options()
+    detector_settings = load_config(options.config).get("detector", {}) if options.config else {}
+    if options.backend is not None:
+        detector_settings["backend"] = options.backend
+    annotations = load_config(options.annotations) if options.annotations else {}
+
+    report = run_benchmark(clips, detector_settings, annotations, options.fps, options.capture_mode)
+    with open(options.output, "w") as f:
+        json.dump(report, f, indent=4)
+
+    print(f"Aggregate: {report['aggregate_fps']:.1f} FPS over {report['elapsed_s']:.1f}s")
+    for label, result in report["streams"].items():
+        line = (f"{label}: {result['fps']:.1f} FPS, inference p50 "
+                f"{result['stages']['inference'].get('p50_ms', 0):.1f} ms, latency p99 "
+                f"{result['latency'].get('p99_ms', 0):.1f} ms")
+        if "accuracy" in result:
+            line += f", counting accuracy {result['accuracy']:.0%}"
+        print(line)
+    print(f"Results written to {options.output}")
@@ -1,8 +1,6 @@
 import cv2
 import numpy as np
-import yolov5  # type: ignore
-from typing import Literal, Optional, List
-import streamlink
+from typing import Literal, Optional, List, Union
 import asyncio
 import websockets
 import json
@@ -11,16 +9,222 @@ import random
 import warnings
 import requests
 import threading
+import queue
+import os
+import sys
+import optparse
+import multiprocessing
+import http.server
+from urllib.parse import unquote
 import string
+import hashlib
+import glob
+import collections
+import logging
+from tracker import Sort
+from detectors import Detector, DETECTOR_SIZE, load_detector
+from metrics import REGISTRY, METRICS_PORT, MetricsServer, setup_logging
+from wire import SUBPROTOCOL_BINARY, SUBPROTOCOLS, encode_batch, encode_json
+from decoders import (IMREAD_FLAGS, STREAM_QUALITY, EncodedFrame, MjpegReader, open_video, read_stride,
+                      select_stream_url)
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
 warnings.filterwarnings("ignore", category=FutureWarning)
 
+# Batched inference
+MAX_BATCH_SIZE = 8     # most frames pushed through the model in one forward pass
+MAX_BATCH_WAIT = 0.02  # seconds to wait for more frames before running a partial batch
+
+# Model input resolution (e.g. 320/416/640) is the "size" of the detector config:
+# lower is faster but less accurate
+LETTERBOX_FILL = 114  # grey padding, as used when training yolov5
+
+# Detection schedule: the detector runs every interval-th frame and the tracker
+# predicts the frames in between. The interval drops to DETECT_EVERY while the ROI
+# is busy and backs off to MAX_DETECT_EVERY while it's empty (e.g. at night).
+DETECT_EVERY = 1
+MAX_DETECT_EVERY = 8
+BUSY_VEHICLES = 3  # vehicles in the ROI at which detection runs at full rate
+
+# Motion gate: frames are differenced inside the ROI and detection is skipped while it's static
+MOTION_SCALE = 4          # compare at 1/4 resolution
+MOTION_THRESHOLD = 25     # grey level change for a pixel to count as moving
+MOTION_MIN_AREA = 0.002   # fraction of the ROI that has to move
+
+# Annotated frames written/served by the AnnotatedFrameSink
+SINK_INTERVAL = 5  # seconds between two annotated frames of the same stream
+SINK_JPEG_QUALITY = 80
+
+# Camera registry
+CONFIG_PATH = "cameras.json"  # JSON, or YAML when the file ends in .yaml/.yml
+STARTUP_TIMEOUT = 15          # seconds for all cameras to deliver a first frame at startup
+READER_STOP_TIMEOUT = 5       # seconds to wait for a capture reader to finish its last read
+
+# Multi-process runner
+WORKER_REPORT_INTERVAL = 5    # seconds between two count reports of a worker
+WORKER_RESTART_DELAY = 2      # seconds before a crashed worker is restarted, doubled per crash
+WORKER_MAX_RESTART_DELAY = 60
+
+# Stream health: failed sources are retried with exponential backoff and jitter
+STREAM_RETRY_DELAY = 1       # seconds after the first failure, doubled per failure
+STREAM_MAX_RETRY_DELAY = 60
+STREAM_DOWN_AFTER = 5        # consecutive failures before a stream is reported down
+
+# Snapshot ("image") cameras
+SNAPSHOT_POLL_INTERVAL = 1.0  # default seconds between two polls of the same camera
+SNAPSHOT_FETCH_WORKERS = 16   # snapshots fetched concurrently
+SNAPSHOT_TIMEOUT = 5          # seconds
+
 # websocket
+SENDER_URL = "ws://localhost:8765/sender?ack=cumulative"
+SEND_BATCH_WINDOW = 0.05  # seconds of detections coalesced into one message
+SEND_QUEUE_SIZE = 1000    # detections buffered while the server is unreachable (oldest dropped)
+RECONNECT_DELAY = 1       # seconds, doubled after every failed attempt
+RECONNECT_MAX_DELAY = 30
+RESEND_BUFFER = 100       # unacked batches kept to resend after a reconnect
+
+log = logging.getLogger("car_detection")
+
+# Metrics, served on /metrics by metrics.MetricsServer
+STAGE_SECONDS = REGISTRY.histogram(
+    "detection_stage_seconds", "Seconds per pipeline stage, latency is capture to publish", ("stream", "stage"))
+FRAMES = REGISTRY.counter("detection_frames_total", "Frames processed", ("stream",))
+DETECTED_FRAMES = REGISTRY.counter("detection_detected_frames_total", "Frames run through the detector", ("stream",))
+STREAM_FPS = REGISTRY.gauge("detection_stream_fps", "Frames processed per second", ("stream",))
+VEHICLES = REGISTRY.counter("detection_vehicles_total", "Vehicles counted", ("stream", "vehicle_class"))
+GRAB_FAILURES = REGISTRY.counter("detection_grab_failures_total", "Failed frame grabs", ("stream",))
+STREAM_CONNECTS = REGISTRY.counter("detection_stream_connects_total", "Captures opened", ("stream",))
+DROPPED_FRAMES = REGISTRY.gauge("detection_dropped_frames", "Stale frames replaced before detection", ("stream",))
+SENDER_RECONNECTS = REGISTRY.counter("detection_sender_reconnects_total", "Failed websocket connections")
+SENDER_DROPPED = REGISTRY.gauge("detection_sender_dropped", "Detections dropped from the full send queue")
+QUEUE_DEPTH = REGISTRY.gauge("detection_queue_depth", "Items waiting in a queue", ("queue",))
+STREAM_UP = REGISTRY.gauge("detection_stream_up", "1 while the stream delivers frames", ("stream",))
+STREAM_RECOVERIES = REGISTRY.counter("detection_stream_recoveries_total", "Outages a stream recovered from",
+                                     ("stream",))
+FPS_WINDOW = 5  # seconds over which detection_stream_fps is averaged
 
 
-async def send_detection_data(data):
-    async with websockets.connect("ws://localhost:8765/sender") as websocket:
-        await websocket.send(json.dumps(data))
-        print(f"Sent data: {data}")
+# One long-lived connection per process. Detection threads only enqueue, the
+# sender's own event loop batches everything queued within batch_window into a
+# single message and reconnects whenever the link drops. Batches go out in the
+# binary format of wire.py, or as {"detections": [...]} JSON to relays that
+# don't negotiate it. Batches stay in a resend buffer until the relay's cumulative
+# ack covers them and go out again after a reconnect (at least once delivery).
+class DetectionSender(threading.Thread):
+    def __init__(self, url: str = SENDER_URL, batch_window: float = SEND_BATCH_WINDOW,
+                 max_queue: int = SEND_QUEUE_SIZE):
+        threading.Thread.__init__(self, name="sender", daemon=True)
+        # Stays the same across reconnects so the relay can drop batches it already
+        # published when the unacked ones are sent again
+        self.producer = generate_random_string(16)
+        self.url = url + ("&" if "?" in url else "?") + f"producer={self.producer}"
+        self.batch_window = batch_window
+        self.max_queue = max_queue
+        self.loop = asyncio.new_event_loop()
+        self.queue: Optional[asyncio.Queue] = None
+        self.running = True
+        self.sent = 0
+        self.dropped = 0
+        self.seq = 0
+        self.unacked = collections.deque()   # (seq, batch) not acked yet, oldest first
+        self.inflight = collections.deque()  # seqs sent on the current connection, not acked yet
+        self.acked = 0                       # messages of the current connection acked
+        self.resend_dropped = 0
+        QUEUE_DEPTH.track(lambda: self.queue.qsize(), queue="sender")
+        SENDER_DROPPED.track(lambda: self.dropped)
+        QUEUE_DEPTH.track(lambda: len(self.unacked), queue="sender_unacked")
+
+    # Thread-safe, never blocks
+    def publish(self, detections: List[dict]):
+        if detections and self.running:
+            self.loop.call_soon_threadsafe(self.enqueue, detections)
+
+    def enqueue(self, detections: List[dict]):
+        for detection in detections:
+            if self.queue.full():
+                self.queue.get_nowait()
+                self.dropped += 1
+            self.queue.put_nowait(detection)
+
+    def stop(self):
+        self.running = False
+        self.loop.call_soon_threadsafe(self.task.cancel)
+
+    async def nextBatch(self):
+        batch = [await self.queue.get()]
+        deadline = self.loop.time() + self.batch_window
+        while True:
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        while not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def send(self, websocket, binary: bool, seq: int, batch: List[dict]):
+        self.inflight.append(seq)
+        await websocket.send(encode_batch(batch, seq) if binary else encode_json(batch, seq))
+        self.sent += len(batch)
+
+    # Keep reading so the relay's sends never back up. A cumulative ack of n
+    # covers the first n messages sent on this connection.
+    async def drainReplies(self, websocket):
+        async for reply in websocket:
+            try:
+                ack = json.loads(reply).get("ack")
+            except (ValueError, AttributeError):
+                continue
+            if not isinstance(ack, int):
+                continue
+            while self.acked < ack and self.inflight:
+                seq = self.inflight.popleft()
+                self.acked += 1
+                while self.unacked and self.unacked[0][0] <= seq:
+                    self.unacked.popleft()
+
+    async def main(self):
+        delay = RECONNECT_DELAY
+        while self.running:
+            try:
+                async with websockets.connect(self.url, subprotocols=SUBPROTOCOLS) as websocket:
+                    binary = websocket.subprotocol == SUBPROTOCOL_BINARY
+                    print(f'\033[92mSender connected to {self.url} ({"binary" if binary else "JSON"})\033[0m')
+                    delay = RECONNECT_DELAY
+                    self.inflight.clear()
+                    self.acked = 0
+                    replies = asyncio.ensure_future(self.drainReplies(websocket))
+                    try:
+                        # Whatever the last connection didn't get acked goes first
+                        for seq, batch in list(self.unacked):
+                            await self.send(websocket, binary, seq, batch)
+                        while True:
+                            batch = await self.nextBatch()
+                            self.seq += 1
+                            self.unacked.append((self.seq, batch))
+                            if len(self.unacked) > RESEND_BUFFER:
+                                self.unacked.popleft()
+                                self.resend_dropped += 1
+                            await self.send(websocket, binary, self.seq, batch)
+                    finally:
+                        replies.cancel()
+            except (OSError, websockets.exceptions.WebSocketException) as e:
+                SENDER_RECONNECTS.inc()
+                log.warning("Sender connection to %s failed (%s), retrying in %ss", self.url, e, delay)
+                await asyncio.sleep(delay * random.uniform(0.5, 1))
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self.task = self.loop.create_task(self.main())
+        try:
+            self.loop.run_until_complete(self.task)
+        except asyncio.CancelledError:
+            pass
 
 
 def generate_random_string(length=6):
@@ -29,30 +233,194 @@ def generate_random_string(length=6):
     return random_string
 
 
+# One pooled keep-alive session per host, shared by every camera on that host
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(url) -> requests.Session:
+    parts = urlsplit(url)
+    host = f"{parts.scheme}://{parts.netloc}"
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4)
+            session.mount(host, adapter)
+            _sessions[host] = session
+        return session
+
+
+# Resizes frames into a preallocated size x size buffer keeping the aspect ratio
+# and padding the rest, so the preprocessing hot path allocates nothing. The
+# buffers are only rebuilt when the source resolution changes.
+class Letterbox:
+    def __init__(self, size: int = DETECTOR_SIZE):
+        self.size = size
+        self.buffer = np.full((size, size, 3), LETTERBOX_FILL, np.uint8)
+        self.source_size = None
+
+    def configure(self, source_size):
+        width, height = source_size
+        self.scale = min(self.size / width, self.size / height)
+        self.width = max(1, round(width * self.scale))
+        self.height = max(1, round(height * self.scale))
+        self.left = (self.size - self.width) // 2
+        self.top = (self.size - self.height) // 2
+        self.resized = np.empty((self.height, self.width, 3), np.uint8)
+        self.buffer[:] = LETTERBOX_FILL
+        self.source_size = source_size
+
+    def __call__(self, frame):
+        source_size = (frame.shape[1], frame.shape[0])
+        if source_size != self.source_size:
+            self.configure(source_size)
+        cv2.resize(frame, (self.width, self.height), dst=self.resized,
+                   interpolation=cv2.INTER_LINEAR)
+        self.buffer[self.top:self.top + self.height, self.left:self.left + self.width] = self.resized
+        return self.buffer
+
+    # Exact inverse of the letterbox for (x1, y1, x2, y2) boxes, in place
+    def invert(self, boxes):
+        width, height = self.source_size
+        boxes[:, [0, 2]] -= self.left
+        boxes[:, [1, 3]] -= self.top
+        boxes /= self.scale
+        # Slices are views, a fancy-indexed out= would only clip a copy
+        np.clip(boxes[:, 0::2], 0, width, out=boxes[:, 0::2])
+        np.clip(boxes[:, 1::2], 0, height, out=boxes[:, 1::2])
+        return boxes
+
+
 # Assuming the frame is Matlike object
-def preprocess_frame(frame, size=(640, 640)):
-    # Resize the frame to the expected size
+def preprocess_frame(frame, letterbox: Letterbox):
     original_size = frame.shape[1], frame.shape[0]  # (width, height)
-    resized_frame = cv2.resize(frame, size)
-    return resized_frame, original_size
+    return letterbox(frame), original_size
 
 
-def postprocess_detections(detections, original_size, resized_size=(640, 640)):
-    original_width, original_height = original_size
-    resized_width, resized_height = resized_size
-    scale_x = original_width / resized_width
-    scale_y = original_height / resized_height
+def postprocess_detections(detections, letterbox: Letterbox):
+    # Work on a numpy copy so all boxes are mapped back in one op
+    if hasattr(detections, "cpu"):
+        detections = detections.cpu().numpy()
+    detections = np.array(detections, dtype=np.float32).reshape(-1, 6)
+    letterbox.invert(detections[:, :4])
 
-    # Clone the detections tensor to allow in-place operations
-    detections = detections.clone()
+    return detections
 
-    for det in detections:
-        det[0] *= scale_x
-        det[1] *= scale_y
-        det[2] *= scale_x
-        det[3] *= scale_y
 
-    return detections
+# Cheap motion check: differences the ROI against the last checked frame at reduced
+# resolution, reusing its buffers between frames
+class MotionGate:
+    def __init__(self, threshold: int = MOTION_THRESHOLD, min_area: float = MOTION_MIN_AREA,
+                 scale: int = MOTION_SCALE):
+        self.threshold = threshold
+        self.min_area = min_area
+        self.scale = scale
+        self.source_size = None
+        self.checked = 0
+        self.skipped = 0
+
+    def configure(self, source_size, roi_polygon):
+        width, height = source_size
+        size = (max(1, width // self.scale), max(1, height // self.scale))
+        self.small = np.empty((size[1], size[0], 3), np.uint8)
+        self.gray = np.empty((size[1], size[0]), np.uint8)
+        self.previous = None
+        self.diff = np.empty_like(self.gray)
+        self.mask = np.zeros_like(self.gray)
+        if roi_polygon is not None:
+            cv2.fillPoly(self.mask, [roi_polygon // self.scale], 255)
+        else:
+            self.mask[:] = 255
+        self.min_pixels = max(1, int(cv2.countNonZero(self.mask) * self.min_area))
+        self.source_size = source_size
+
+    def moving(self, frame, roi_polygon) -> bool:
+        source_size = (frame.shape[1], frame.shape[0])
+        if source_size != self.source_size:
+            self.configure(source_size, roi_polygon)
+        cv2.resize(frame, (self.gray.shape[1], self.gray.shape[0]), dst=self.small,
+                   interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self.small, cv2.COLOR_BGR2GRAY, dst=self.gray)
+        self.checked += 1
+        if self.previous is None:
+            self.previous = self.gray.copy()
+            return True
+
+        cv2.absdiff(self.gray, self.previous, dst=self.diff)
+        cv2.threshold(self.diff, self.threshold, 255, cv2.THRESH_BINARY, dst=self.diff)
+        cv2.bitwise_and(self.diff, self.mask, dst=self.diff)
+        moving = cv2.countNonZero(self.diff) >= self.min_pixels
+        # Keep the reference frame while static, so slow motion still adds up
+        if moving:
+            self.previous, self.gray = self.gray, self.previous
+        else:
+            self.skipped += 1
+        return moving
+
+
+class DetectionSchedule:
+    def __init__(self, min_interval: int = DETECT_EVERY, max_interval: int = MAX_DETECT_EVERY,
+                 busy: int = BUSY_VEHICLES):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.busy = busy
+        self.interval = min_interval
+        self.since_detection = 0
+
+    def due(self) -> bool:
+        self.since_detection += 1
+        return self.since_detection >= self.interval
+
+    def update(self, vehicles: int):
+        self.since_detection = 0
+        if vehicles >= self.busy:
+            self.interval = self.min_interval
+        elif vehicles == 0:
+            self.interval = min(self.interval * 2, self.max_interval)
+        else:
+            self.interval = max(self.min_interval, self.interval // 2)
+
+
+# Counted classes, in the column order used by VehicleCounts.toArray()
+VEHICLE_CLASSES = ('car', 'bus', 'motorcycle')
+BOX_COLORS = ((0, 255, 0), (255, 255, 0), (0, 0, 255))  # Green cars, blue buses, red motorcycles
+
+
+# Precomputed per-stream lookups so a whole frame of detections is filtered by
+# ROI and class in a few array ops instead of a pointPolygonTest and several
+# name comparisons per box
+class RoiFilter:
+    def __init__(self, roi_polygon, frame_size, class_names):
+        width, height = frame_size
+        self.size = frame_size
+        self.mask = np.zeros((height, width), np.uint8)
+        if roi_polygon is not None:
+            cv2.fillPoly(self.mask, [roi_polygon], 1)
+        self.mask = self.mask.astype(bool)
+
+        # Model class id -> VEHICLE_CLASSES column, -1 for classes we don't count
+        if isinstance(class_names, dict):
+            class_names = [class_names.get(i, "") for i in range(max(class_names) + 1)]
+        self.columns = np.array([VEHICLE_CLASSES.index(name) if name in VEHICLE_CLASSES else -1
+                                 for name in class_names], dtype=np.int64)
+
+    def vehicles(self, detections):
+        return self.columns[detections[:, 5].astype(np.int64)] >= 0
+
+    # Returns the kept detections, their class columns and the per-class counts
+    def apply(self, detections):
+        width, height = self.size
+        centers = ((detections[:, 0:2] + detections[:, 2:4]) / 2).astype(np.int64)
+        np.clip(centers[:, 0], 0, width - 1, out=centers[:, 0])
+        np.clip(centers[:, 1], 0, height - 1, out=centers[:, 1])
+        in_roi = self.mask[centers[:, 1], centers[:, 0]]
+
+        columns = self.columns[detections[:, 5].astype(np.int64)]
+        keep = in_roi & (columns >= 0)
+        columns = columns[keep]
+        counts = np.bincount(columns, minlength=len(VEHICLE_CLASSES))
+        return detections[keep], columns, counts
 
 
 class VehicleCounts:
@@ -65,21 +433,260 @@ class VehicleCounts:
         self.bus = bus
         self.motorcycle = motorcycle
 
+    def toArray(self):
+        return np.array([self.car, self.bus, self.motorcycle], dtype=np.int64)
+
+    @classmethod
+    def fromArray(cls, counts):
+        return cls(*(int(count) for count in counts))
+
+
+# Health of a stream source. Consecutive failures put it on an exponential backoff
+# with jitter (connecting -> retrying -> down), the first good frame brings it back up.
+class SourceHealth:
+    STATES = ("connecting", "up", "retrying", "down")
+
+    def __init__(self, label: str, base_delay: float = STREAM_RETRY_DELAY,
+                 max_delay: float = STREAM_MAX_RETRY_DELAY, down_after: int = STREAM_DOWN_AFTER):
+        self.label = label
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.down_after = down_after
+        self.state = "connecting"
+        self.failures = 0
+        self.recoveries = 0
+        self.retry_at = 0.0
+        self.lock = threading.Lock()
+        STREAM_UP.track(lambda: float(self.state == "up"), stream=label)
+
+    # Returns the seconds to wait before the next attempt
+    def failed(self) -> float:
+        with self.lock:
+            self.failures += 1
+            delay = min(self.max_delay, self.base_delay * 2 ** (self.failures - 1))
+            delay *= random.uniform(0.5, 1)
+            self.retry_at = time.monotonic() + delay
+            if self.failures >= self.down_after:
+                self.transition("down")
+            elif self.state == "up":
+                self.transition("retrying")
+            return delay
+
+    def succeeded(self):
+        if self.state == "up":
+            return
+        with self.lock:
+            if self.state in ("retrying", "down"):
+                self.recoveries += 1
+                STREAM_RECOVERIES.inc(stream=self.label)
+            self.failures = 0
+            self.transition("up")
+
+    def transition(self, state: str):
+        if state == self.state:
+            return
+        if state == "down":
+            log.error("%s is down after %d failures, retrying every %.0fs at most",
+                      self.label, self.failures, self.max_delay)
+        elif state == "up" and self.state != "connecting":
+            log.info("%s recovered", self.label)
+        self.state = state
+
+
+# Single-slot frame buffer: a new frame replaces the old one if it hasn't been read yet
+class FrameSlot:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.frame = None
+        self.time = None       # when the frame in the slot was captured
+        self.read_time = None  # capture time of the frame returned by the last get()
+        self.seq = 0
+        self.read_seq = 0
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, frame, capture_time=None):
+        with self.cond:
+            if self.seq > self.read_seq:
+                self.dropped += 1
+            self.frame = frame
+            self.time = capture_time if capture_time is not None else time.perf_counter()
+            self.seq += 1
+            self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def get(self, timeout=None):
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.seq > self.read_seq or self.closed, timeout):
+                return (False, None)
+            if self.seq == self.read_seq:
+                return (False, None)
+            self.read_seq = self.seq
+            self.read_time = self.time
+            return (True, self.frame)
+
+
+# Keeps decoding a stream on its own thread so detection always gets the newest frame
+class LatestFrameReader(threading.Thread):
+    def __init__(self, stream: "Stream"):
+        threading.Thread.__init__(self, name=f"capture-{stream.label}", daemon=True)
+        self.stream = stream
+        self.slot = stream.slot
+        self.running = True
+
+        self.stopped = threading.Event()
+
+    def stop(self):
+        self.running = False
+        self.stopped.set()
+
+    # Reconnects run here, so a dead camera only ever holds up its own reader.
+    # The capture is released here too, once no read can be using it anymore.
+    def run(self):
+        health = self.stream.health
+        try:
+            while self.running:
+                ret, frame = self.stream.grab(encoded=True)
+                if ret and frame is not None:
+                    health.succeeded()
+                    self.slot.put(frame, self.stream.capture_time)
+                elif not ret:
+                    if not self.stream.live:
+                        break
+                    delay = health.failed()
+                    log.warning("Failed to grab frame from %s, reconnecting in %.1fs", self.stream.label, delay)
+                    self.stopped.wait(delay)
+        finally:
+            self.slot.close()
+            if self.stream.cap is not None:
+                self.stream.cap.release()
+                self.stream.cap = None
+
+
+# Polls every registered "image" camera at its own poll_interval, fetching many
+# cameras at once on a worker pool. Only changed snapshots are decoded and
+# handed to the stream's FrameSlot.
+class SnapshotPoller(threading.Thread):
+    def __init__(self, max_workers: int = SNAPSHOT_FETCH_WORKERS):
+        threading.Thread.__init__(self, name="snapshot-poller", daemon=True)
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix="snapshot")
+        self.streams = {}  # label -> [stream, next poll time, fetch in flight]
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.running = True
+        self.fetched = 0
+        self.unchanged = 0
+
+    def register(self, stream: "Stream"):
+        stream.slot = FrameSlot()
+        stream.poller = self
+        with self.lock:
+            self.streams[stream.label] = [stream, 0.0, False]
+        self.wake.set()
+
+    def unregister(self, stream: "Stream"):
+        with self.lock:
+            self.streams.pop(stream.label, None)
+        stream.slot.close()
+
+    def stop(self):
+        self.running = False
+        self.wake.set()
+        self.executor.shutdown(wait=False)
+
+    def poll(self, stream: "Stream"):
+        delay = stream.poll_interval
+        try:
+            unchanged = stream.unchanged_snapshots
+            start = time.perf_counter()
+            ret, frame = stream.fetchSnapshot()
+            self.fetched += 1
+            if stream.unchanged_snapshots > unchanged:
+                self.unchanged += 1
+            if ret:
+                stream.health.succeeded()
+            else:
+                GRAB_FAILURES.inc(stream=stream.label)
+                # Back off from cameras that stopped answering
+                delay = max(delay, stream.health.failed())
+            if ret and frame is not None:
+                stream.observe("decode", time.perf_counter() - start)
+                stream.slot.put(frame, start)
+        finally:
+            with self.lock:
+                entry = self.streams.get(stream.label)
+                if entry is not None:
+                    entry[1] = time.monotonic() + delay
+                    entry[2] = False
+            self.wake.set()
+
+    def run(self):
+        while self.running:
+            now = time.monotonic()
+            next_due = now + SNAPSHOT_POLL_INTERVAL
+            with self.lock:
+                for entry in self.streams.values():
+                    stream, due, in_flight = entry
+                    if in_flight:
+                        continue
+                    if due <= now:
+                        entry[2] = True
+                        self.executor.submit(self.poll, stream)
+                    else:
+                        next_due = min(next_due, due)
+            self.wake.wait(max(0, next_due - time.monotonic()))
+            self.wake.clear()
+
+
+# Raw per-stage timings of a stream's pipeline, only collected when attached as
+# Stream.timings (see benchmark.py). "latency" is capture to publish. The
+# detection_stage_seconds histogram gets the same samples either way.
+class StageTimings:
+    STAGES = ("decode", "preprocess", "inference", "postprocess", "publish", "latency")
+
+    def __init__(self):
+        self.samples = {stage: [] for stage in self.STAGES}
+        self.started = None
+        self.finished = None
+
+    def record(self, stage: str, seconds: float):
+        self.samples[stage].append(seconds)
+
 
 class Stream:
     url: str
-    type: Literal["youtube", "image", "mjpg"]
+    type: Literal["youtube", "image", "mjpg", "file"]
     label: str
-    cap: Optional[cv2.VideoCapture]
+    cap: Optional[Union[cv2.VideoCapture, MjpegReader]]
     roi_points: list
     roi_polygon = None
     total_counts: VehicleCounts
     current_counts: VehicleCounts
-    prev_counts: VehicleCounts
     camNumber: int
+    capture_mode: Literal["direct", "latest"]
+    reader: Optional[LatestFrameReader]
+    poller: Optional["SnapshotPoller"]
+    slot: Optional[FrameSlot]
+    health: SourceHealth
+    poll_interval: float
+    decode_scale: Literal[1, 2, 4, 8]
+    frame_stride: int
+    quality: str
+    hwaccel: bool
+    motion: Optional[dict]
+    schedule: dict
 
-    def __init__(self, url: str, type: Literal["youtube", "image", "mjpg"],
-                 label: str = f"Camera@{generate_random_string()}", roi_points: Optional[List] = None):
+    def __init__(self, url: str, type: Literal["youtube", "image", "mjpg", "file"],
+                 label: str = f"Camera@{generate_random_string()}", roi_points: Optional[List] = None,
+                 capture_mode: Literal["direct", "latest"] = "latest",
+                 poll_interval: float = SNAPSHOT_POLL_INTERVAL,
+                 decode_scale: Literal[1, 2, 4, 8] = 1,
+                 motion: Optional[dict] = None, schedule: Optional[dict] = None,
+                 frame_stride: int = 1, quality: str = STREAM_QUALITY, hwaccel: bool = False):
         self.url = url
         self.type = type
         self.label = label
@@ -88,51 +695,260 @@ class Stream:
         self.roi_polygon = None
         self.total_counts = VehicleCounts()
         self.current_counts = VehicleCounts()
-        self.prev_counts = VehicleCounts()
+        self.capture_mode = capture_mode
+        # Frames are downscaled once when decoded, ROI points refer to the scaled frame.
+        # JPEG sources ("image", "mjpg") are decoded at that scale directly.
+        self.decode_scale = decode_scale
+        # Only every frame_stride-th frame of "mjpg"/"youtube" sources is decoded,
+        # "youtube" plays the streamlink variant quality, optionally decoded on the GPU
+        self.frame_stride = frame_stride
+        self.quality = quality
+        self.hwaccel = hwaccel
+        # MotionGate / DetectionSchedule settings, motion=None disables the gate
+        self.motion = motion
+        self.schedule = schedule if schedule is not None else {}
+        # Recorded clips ("file"): a video, a directory of images or a glob pattern,
+        # replayed at replay_fps or as fast as possible when None
+        self.replay_fps = None
+        self.files = None
+        self.file_index = 0
+        self.replay_start = None
+        # Capture times are taken right before a frame is read, so every source and
+        # capture mode measures latency over the same span. capture_time is the last
+        # grab's (on the reader thread in "latest" mode), frame_time the one of the
+        # frame being detected.
+        self.capture_time = None
+        self.frame_time = None
+        self.timings: Optional[StageTimings] = None
+        self.reader = None
+        self.poller = None
+        self.slot = None
+        self.health = SourceHealth(label)
+        # Snapshot polling state
+        self.poll_interval = poll_interval
+        self.etag = None
+        self.last_modified = None
+        self.content_hash = None
+        self.unchanged_snapshots = 0
 
-    def getFrame(self, retry_interval=1, max_retries=5):
-        print(f"Getting frame {self.label}")
+    # Plain dict describing the stream, used to recreate it in a worker process
+    def spec(self) -> dict:
+        return {
+            "url": self.url,
+            "type": self.type,
+            "label": self.label,
+            "roi_points": [tuple(point) for point in self.roi_points],
+            "camNumber": getattr(self, "camNumber", 0),
+            "capture_mode": self.capture_mode,
+            "poll_interval": self.poll_interval,
+            "decode_scale": self.decode_scale,
+            "motion": self.motion,
+            "schedule": self.schedule,
+            "frame_stride": self.frame_stride,
+            "quality": self.quality,
+            "hwaccel": self.hwaccel,
+        }
 
-        retry_count = max_retries
-        ret, frame = (False, None)
-        while retry_count > 0:
+    @classmethod
+    def fromSpec(cls, spec: dict) -> "Stream":
+        stream = cls(spec["url"], spec["type"], spec["label"], list(spec["roi_points"]),
+                     spec["capture_mode"], spec["poll_interval"], spec["decode_scale"],
+                     spec["motion"], spec["schedule"], spec["frame_stride"], spec["quality"],
+                     spec["hwaccel"])
+        stream.camNumber = spec["camNumber"]
+        return stream
 
-            if (self.cap != None) and (self.type != "image"):
-                ret, frame = self.cap.read()
-            elif (self.type == "youtube"):
-                streams = streamlink.streams(self.url)
-                stream_url = streams['best'].url
-                self.cap = cv2.VideoCapture(stream_url)
-                ret, frame = self.cap.read()
-            elif (self.type == "image"):
-                response = requests.get(self.url)
-                if response.status_code == 200:
-                    image_array = np.frombuffer(
-                        response.content, dtype=np.uint8)
-                    image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
-                    ret, frame = (response.status_code == 200, image)
-                else:
-                    ret, frame = (response.status_code == 200, None)
-            elif (self.type == "mjpg"):
+    def observe(self, stage: str, seconds: float):
+        STAGE_SECONDS.observe(seconds, stream=self.label, stage=stage)
+        if self.timings is not None:
+            self.timings.record(stage, seconds)
+
+    # Live cameras are reconnected when they fail, recorded clips just end
+    @property
+    def live(self) -> bool:
+        return self.type != "file"
+
+    @property
+    def dropped_frames(self) -> int:
+        return self.slot.dropped if self.slot is not None else 0
+
+    def startCapture(self):
+        # Streams registered with a SnapshotPoller are already being fed
+        if self.slot is not None:
+            return
+        if self.capture_mode == "latest":
+            self.slot = FrameSlot()
+            self.reader = LatestFrameReader(self)
+            self.reader.start()
+
+    def stopCapture(self):
+        if self.reader is not None:
+            self.reader.stop()
+        if self.poller is not None:
+            self.poller.unregister(self)
+
+    # Next frame for detection: the freshest frame from the reader or snapshot
+    # poller, otherwise read inline on the calling thread
+    def read(self):
+        if self.slot is not None:
+            ret, frame = self.slot.get()
+            self.frame_time = self.slot.read_time
+            if ret and isinstance(frame, EncodedFrame):
+                # MJPEG frames are only decoded once detection takes them
+                start = time.perf_counter()
+                frame = frame.decode()
+                ret = frame is not None
+                self.observe("decode", time.perf_counter() - start)
+            return (ret, frame)
+        ret, frame = self.getFrame()
+        self.frame_time = self.capture_time
+        return (ret, frame)
+
+    # Holds a replayed clip to replay_fps, called before the read is timed
+    def pace(self):
+        if self.replay_start is None:
+            self.replay_start = time.perf_counter()
+        delay = self.replay_start + self.file_index / self.replay_fps - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    def readFile(self):
+        if self.cap is None and self.files is None:
+            if os.path.isdir(self.url):
+                self.files = sorted(os.path.join(self.url, name) for name in os.listdir(self.url)
+                                    if name.lower().endswith((".jpg", ".jpeg", ".png")))
+            elif any(char in self.url for char in "*?["):
+                self.files = sorted(glob.glob(self.url))
+            else:
                 self.cap = cv2.VideoCapture(self.url)
+
+        self.file_index += 1
+
+        if self.cap is not None:
+            return self.cap.read()
+        if self.file_index > len(self.files):
+            return (False, None)
+        frame = cv2.imread(self.files[self.file_index - 1])
+        return (frame is not None, frame)
+
+    # Conditional GET of an "image" camera. Returns (True, None) when the camera
+    # hasn't updated since the last fetch, so nothing is decoded or detected.
+    def fetchSnapshot(self):
+        headers = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        try:
+            response = get_session(self.url).get(
+                self.url, headers=headers, timeout=SNAPSHOT_TIMEOUT)
+        except requests.RequestException:
+            return (False, None)
+
+        if response.status_code == 304:
+            self.unchanged_snapshots += 1
+            return (True, None)
+        if response.status_code != 200:
+            return (False, None)
+        self.etag = response.headers.get("ETag")
+        self.last_modified = response.headers.get("Last-Modified")
+
+        # Most cheap cameras send neither header, so compare the bytes too
+        content_hash = hashlib.blake2b(response.content, digest_size=16).digest()
+        if content_hash == self.content_hash:
+            self.unchanged_snapshots += 1
+            return (True, None)
+        self.content_hash = content_hash
+
+        image_array = np.frombuffer(response.content, dtype=np.uint8)
+        image = cv2.imdecode(image_array, self.imdecodeFlags())
+        return (image is not None, image)
+
+    # JPEGs can be decoded straight to 1/2, 1/4 or 1/8 scale
+    def imdecodeFlags(self):
+        return IMREAD_FLAGS[self.decode_scale]
+
+    # One attempt at the next frame, only sleeps to pace a replay. A failed source is
+    # released so the next attempt reconnects; encoded=True hands out "mjpg" frames
+    # as undecoded EncodedFrames. "image" returns (True, None) while unchanged.
+    def grab(self, encoded=False):
+        log.debug("Getting frame %s", self.label)
+
+        if (self.type == "file") and self.replay_fps:
+            self.pace()
+        start = time.perf_counter()
+        if (self.type == "file"):
+            ret, frame = self.readFile()
+        elif (self.type == "image"):
+            ret, frame = self.fetchSnapshot()
+        elif (self.cap != None) and (self.type == "mjpg"):
+            ret, frame = self.cap.read(encoded)
+        elif (self.cap != None):
+            ret, frame = read_stride(self.cap, self.frame_stride)
+        elif (self.type == "youtube"):
+            ret, frame = (False, None)
+            stream_url = select_stream_url(self.url, self.quality)
+            if stream_url is not None:
+                self.cap = open_video(stream_url, self.hwaccel)
+                STREAM_CONNECTS.inc(stream=self.label)
                 ret, frame = self.cap.read()
-            else:
+        elif (self.type == "mjpg"):
+            try:
+                self.cap = MjpegReader(self.url, self.decode_scale, self.frame_stride)
+                STREAM_CONNECTS.inc(stream=self.label)
+                ret, frame = self.cap.read(encoded)
+            except requests.RequestException:
                 ret, frame = (False, None)
+        else:
+            ret, frame = (False, None)
 
-            if not ret:
-                print(f"Failed to grab frame from {self.label}. Retrying...")
-                time.sleep(retry_interval)
-                retry_count -= 1
-            else:
-                break
+        if not ret:
+            if self.live:
+                GRAB_FAILURES.inc(stream=self.label)
+                if self.cap is not None:
+                    self.cap.release()
+                    self.cap = None
+            return (False, None)
+        if frame is None:
+            return (True, None)
 
-        return (ret, frame)
+        if self.decode_scale > 1 and self.type not in ("image", "mjpg"):
+            frame = cv2.resize(frame, None, fx=1 / self.decode_scale, fy=1 / self.decode_scale,
+                               interpolation=cv2.INTER_AREA)
+        self.capture_time = start
+        # Encoded frames are timed when they're decoded
+        if not isinstance(frame, EncodedFrame):
+            self.observe("decode", time.perf_counter() - start)
+        return (True, frame)
 
-    def selectROI(self):
-        ret, frame = self.getFrame()
-        if not ret:
-            print("Failed to grab first frame")
-            exit()
+    # Next frame on the calling thread, backing off between failed attempts
+    def getFrame(self, max_retries=5, encoded=False):
+        attempts = 0
+        while attempts < max_retries:
+            ret, frame = self.grab(encoded)
+            if ret and frame is None:
+                # Camera hasn't updated yet, wait for the next poll
+                time.sleep(self.poll_interval)
+                continue
+            if ret:
+                self.health.succeeded()
+                return (ret, frame)
+            if not self.live:
+                # End of the clip, nothing to retry
+                break
+            attempts += 1
+            delay = self.health.failed()
+            if attempts < max_retries:
+                log.warning("Failed to grab frame from %s, retrying in %.1fs", self.label, delay)
+                time.sleep(delay)
+        return (False, None)
+
+    def selectROI(self, frame=None):
+        if frame is None:
+            ret, frame = self.getFrame()
+            if not ret:
+                print("Failed to grab first frame")
+                exit()
 
         cv2.namedWindow(f'ROI Selection - {self.label}')
         cv2.setMouseCallback(f'ROI Selection - {self.label}', self.click_event)
@@ -159,193 +975,764 @@ class Stream:
             self.roi_points.append((x, y))
 
 
+# Every StreamThread submits its latest preprocessed frame and waits on the returned
+# future. The scheduler collects up to max_batch_size frames (waiting at most max_wait
+# seconds after the first one arrives), runs one forward pass and hands each stream
+# back its own detections.
+class InferenceScheduler(threading.Thread):
+    def __init__(self, model: Detector, max_batch_size: int = MAX_BATCH_SIZE,
+                 max_wait: float = MAX_BATCH_WAIT):
+        threading.Thread.__init__(self, name="inference", daemon=True)
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.pending = queue.Queue()
+        QUEUE_DEPTH.track(self.pending.qsize, queue="inference")
+        self.running = True
+        self.batches = 0
+        self.frames = 0
+
+    def submit(self, frame) -> Future:
+        future = Future()
+        self.pending.put((frame, future))
+        return future
+
+    def stop(self):
+        self.running = False
+        self.pending.put(None)
+
+    def collectBatch(self):
+        first = self.pending.get()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.pending.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self.running = False
+                break
+            batch.append(item)
+        return batch
+
+    def run(self):
+        while self.running:
+            batch = self.collectBatch()
+            if not batch:
+                continue
+            frames = [frame for frame, _ in batch]
+            try:
+                preds = self.model(frames)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.frames += len(batch)
+            for (_, future), pred in zip(batch, preds):
+                future.set_result(pred)
+
+        # Don't leave streams waiting on frames that will never be run
+        while not self.pending.empty():
+            item = self.pending.get_nowait()
+            if item is not None:
+                item[1].set_exception(RuntimeError("Inference scheduler stopped"))
+
+
+# Low-rate annotated frames for operators when running headless: a JPEG per stream
+# every interval seconds written to out_dir and/or served over HTTP at
+# /<label>.jpg (latest frame) and /<label>.mjpg (MJPEG feed)
+class AnnotatedFrameSink:
+    def __init__(self, interval: float = SINK_INTERVAL, out_dir: Optional[str] = None,
+                 port: Optional[int] = None):
+        self.interval = interval
+        self.out_dir = out_dir
+        self.latest = {}       # label -> JPEG bytes
+        self.last_put = {}     # label -> time of the last annotated frame
+        self.cond = threading.Condition()
+        self.server = None
+        if out_dir is not None:
+            os.makedirs(out_dir, exist_ok=True)
+        if port is not None:
+            self.server = http.server.ThreadingHTTPServer(("", port), self.handlerClass())
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, name="frame-sink", daemon=True).start()
+            print(f'\033[92mServing annotated frames at http://localhost:{port}/<label>.mjpg\033[0m')
+
+    def due(self, label) -> bool:
+        last = self.last_put.get(label)
+        return last is None or time.monotonic() - last >= self.interval
+
+    def put(self, label, frame):
+        self.last_put[label] = time.monotonic()
+        ok, jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, SINK_JPEG_QUALITY])
+        if not ok:
+            return
+        jpeg = jpeg.tobytes()
+        if self.out_dir is not None:
+            with open(os.path.join(self.out_dir, f"{label}.jpg"), "wb") as f:
+                f.write(jpeg)
+        with self.cond:
+            self.latest[label] = jpeg
+            self.cond.notify_all()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+
+    def handlerClass(self):
+        sink = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                name = unquote(self.path.lstrip("/"))
+                label, _, extension = name.rpartition(".")
+                if label not in sink.latest or extension not in ("jpg", "mjpg"):
+                    self.send_error(404)
+                    return
+                if extension == "jpg":
+                    self.sendJpeg(sink.latest[label])
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=frame")
+                self.end_headers()
+                jpeg = None
+                try:
+                    while True:
+                        with sink.cond:
+                            sink.cond.wait_for(lambda: sink.latest[label] is not jpeg)
+                            jpeg = sink.latest[label]
+                        self.wfile.write(b"--frame\r\nContent-Type: image/jpeg\r\n")
+                        self.wfile.write(f"Content-Length: {len(jpeg)}\r\n\r\n".encode())
+                        self.wfile.write(jpeg + b"\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def sendJpeg(self, jpeg):
+                self.send_response(200)
+                self.send_header("Content-Type", "image/jpeg")
+                self.send_header("Content-Length", str(len(jpeg)))
+                self.end_headers()
+                self.wfile.write(jpeg)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
 class StreamThread(threading.Thread):
-    def __init__(self, stream: Stream, model):
+    def __init__(self, stream: Stream, model: Detector, sender: DetectionSender,
+                 scheduler: Optional[InferenceScheduler] = None,
+                 headless: bool = False,
+                 sink: Optional["AnnotatedFrameSink"] = None):
         threading.Thread.__init__(self)
         self.stream = stream
         self.model = model
+        self.sender = sender
+        self.scheduler = scheduler
+        self.letterbox = Letterbox(model.size)
+        self.roi_filter: Optional[RoiFilter] = None
+        self.tracker = Sort()
+        self.counted_ids = set()
+        self.schedule = DetectionSchedule(**stream.schedule)
+        self.motion_gate = MotionGate(**stream.motion) if stream.motion is not None else None
+        self.frames = 0
+        self.detected_frames = 0
+        self.recoveries = 0
+        self.running = True
+        self.failed = False
+        self.headless = headless
+        self.sink = sink
+
+    def stop(self):
+        self.running = False
+        if self.stream.slot is not None:
+            self.stream.slot.close()
+
+    # The source came back after an outage: its tracks and motion reference are
+    # stale, so counting starts over from the new frames
+    def rejoin(self):
+        self.recoveries = self.stream.health.recoveries
+        self.tracker = Sort()
+        self.counted_ids.clear()
+        self.schedule = DetectionSchedule(**self.stream.schedule)
+        if self.motion_gate is not None:
+            self.motion_gate.source_size = None
+        log.info("%s rejoined detection", self.stream.label)
+
+    def annotate(self, frame, tracks, columns):
+        # Draw ROI polygon
+        if self.stream.roi_polygon is not None:
+            cv2.polylines(frame, [self.stream.roi_polygon], True, (255, 0, 0), 2)
 
+        for det, column in zip(tracks, columns):
+            x1, y1, x2, y2 = det[:4].astype(int)
+            cv2.rectangle(frame, (x1, y1), (x2, y2), BOX_COLORS[column], 2)
+
+        # Predefine text positions and properties
+        text_positions = [
+            (f'Total Cars: {self.stream.total_counts.car}',
+             (10, 70), (0, 255, 0)),
+            (f'Total Buses: {self.stream.total_counts.bus}',
+             (10, 150), (255, 255, 0)),
+            (f'Total Motorcycles: {self.stream.total_counts.motorcycle}',
+             (10, 230), (0, 0, 255))
+        ]
+
+        # Add counts to the frame
+        for text, position, color in text_positions:
+            cv2.putText(frame, text, position,
+                        cv2.FONT_HERSHEY_SIMPLEX, 1, color, 2)
+
+    def detect(self, frame):
+        if self.scheduler is not None:
+            return self.scheduler.submit(frame).result()
+        return self.model([frame])[0]
+
+    # An exception is logged and marks the thread failed, run_streams reports it
     def run(self):
+        try:
+            self.detectLoop()
+        except Exception:
+            self.failed = True
+            log.exception("Thread for %s died", self.stream.label)
+
+    def detectLoop(self):
         print(f'\033[92mThread for {self.stream.label} started\033[0m')
-        # Create a new event loop for this thread
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        if self.stream.timings is not None:
+            self.stream.timings.started = time.perf_counter()
+        label = self.stream.label
+        DROPPED_FRAMES.track(lambda: self.stream.dropped_frames, stream=label)
+        fps_start, fps_frames = time.monotonic(), 0
 
-        while True:
-            ret, frame = self.stream.getFrame()
+        self.stream.startCapture()
+        while self.running:
+            ret, frame = self.stream.read()
             if not ret or frame is None:
-                print("Failed to grab frame")
+                # Live sources reconnect on their own (with backoff), keep waiting for them
+                slot = self.stream.slot
+                if self.running and self.stream.live and (slot is None or not slot.closed):
+                    continue
                 break
+            if self.stream.health.recoveries != self.recoveries:
+                self.rejoin()
 
-            # Create a copy of the frame to draw on
-            display_frame = frame.copy()
+            # Detection runs on the schedule's frames if something moved in the ROI,
+            # the tracker fills in the frames in between
+            self.frames += 1
+            FRAMES.inc(stream=label)
+            fps_frames += 1
+            if time.monotonic() - fps_start >= FPS_WINDOW:
+                STREAM_FPS.set(fps_frames / (time.monotonic() - fps_start), stream=label)
+                fps_start, fps_frames = time.monotonic(), 0
+            due = self.roi_filter is None or self.schedule.due()
+            static = due and self.roi_filter is not None and self.motion_gate is not None and \
+                not self.motion_gate.moving(frame, self.stream.roi_polygon)
+            run_detection = due and not static
+            if run_detection:
+                self.detected_frames += 1
+                DETECTED_FRAMES.inc(stream=label)
+                start = time.perf_counter()
+                inference_frame, original_size = preprocess_frame(frame, self.letterbox)
+                preprocessed = time.perf_counter()
+                pred = self.detect(inference_frame)
+                detected = time.perf_counter()
+                self.stream.observe("preprocess", preprocessed - start)
+                self.stream.observe("inference", detected - preprocessed)
 
-            # Draw ROI polygon
-            if self.stream.roi_polygon is not None:
-                cv2.polylines(display_frame, [
-                    self.stream.roi_polygon], True, (255, 0, 0), 2)
-
-            # Perform detection
-            frame, original_size = preprocess_frame(frame)
-            results = model(frame)
-
-            # Post-process detections to scale them back to the original frame size
-            detections = postprocess_detections(results.pred[0], original_size)
-
-            # Reset current counts for this frame
-            self.stream.current_counts = VehicleCounts()
-
-            for det in detections:
-                class_id = int(det[5])
-                x1, y1, x2, y2 = map(int, det[:4])
-                center = ((x1 + x2) // 2, (y1 + y2) // 2)
-                lane = 0
-                # Check if the center of the object is in the ROI
-                if self.stream.roi_polygon is not None and cv2.pointPolygonTest(self.stream.roi_polygon, center, False) >= 0:
-                    if model.names[class_id] == 'car':
-                        self.stream.current_counts.car += 1
-                        cv2.rectangle(display_frame, (x1, y1), (x2, y2),
-                                      (0, 255, 0), 2)  # Green for cars
-                        # lane = random.choice([1, 2])  # Randomly set lane
-                    elif model.names[class_id] == 'bus':
-                        self.stream.current_counts.bus += 1
-                        cv2.rectangle(display_frame, (x1, y1), (x2, y2),
-                                      (255, 255, 0), 2)  # Blue for buses
-                        # lane = random.choice([1, 2])  # Randomly set lane
-                    elif model.names[class_id] == 'motorcycle':
-                        self.stream.current_counts.motorcycle += 1
-                        cv2.rectangle(display_frame, (x1, y1), (x2, y2),
-                                      (0, 0, 255), 2)  # Red for motorcycles
-                        lane = 0  # Motorcycles use lane 1
-                    if (model.names[class_id] == 'car' or model.names[class_id] == 'bus' or model.names[class_id] == 'motorcycle'):
-                        # Randomly set willTurn
-                        will_turn = random.choice([0, 1, 2])
-                        if (model.names[class_id] != 'motorcycle'):
-                            if (will_turn != 1):
-                                lane = 2
-                            else:
-                                lane = random.choice([1, 2])
-                        else:
-                            if (will_turn != 1):
-                                lane = 2
-                            else:
-                                lane = 0
-                        # Create detection data
-                        detection_data = {
-                            "direction": self.stream.camNumber,  # This could be updated based on your needs
-                            "lane": lane,
-                            "vehicleClass": model.names[class_id],
-                            "turn": will_turn,
-                            "label": self.stream.label,
-                        }
-                        if ((model.names[class_id] == 'car' and self.stream.current_counts.car > self.stream.prev_counts.car) or (model.names[class_id] == 'bus' and self.stream.current_counts.bus > self.stream.prev_counts.bus) or (model.names[class_id] == 'motorcycle' and self.stream.current_counts.motorcycle > self.stream.prev_counts.motorcycle)):
-                            # Send data to WebSocket server
-                            loop.run_until_complete(
-                                send_detection_data(detection_data))
-
-            # Update total counts only if the current counts have changed
-            if self.stream.current_counts.car > self.stream.prev_counts.car:
-                self.stream.total_counts.car += (self.stream.current_counts.car -
-                                                 self.stream.prev_counts.car)
-            if self.stream.current_counts.bus > self.stream.prev_counts.bus:
-                self.stream.total_counts.bus += (self.stream.current_counts.bus -
-                                                 self.stream.prev_counts.bus)
-            if self.stream.current_counts.motorcycle > self.stream.prev_counts.motorcycle:
-                self.stream.total_counts.motorcycle += (self.stream.current_counts.motorcycle -
-                                                        self.stream.prev_counts.motorcycle)
-
-            # Update previous counts
-            self.stream.prev_counts.car = self.stream.current_counts.car
-            self.stream.prev_counts.bus = self.stream.current_counts.bus
-            self.stream.prev_counts.motorcycle = self.stream.current_counts.motorcycle
-
-            # Predefine text positions and properties
-            text_positions = [
-                (f'Total Cars: {self.stream.total_counts.car}',
-                 (10, 70), (0, 255, 0)),
-                (f'Total Buses: {self.stream.total_counts.bus}',
-                 (10, 150), (255, 255, 0)),
-                (f'Total Motorcycles: {self.stream.total_counts.motorcycle}',
-                 (10, 230), (0, 0, 255))
-            ]
-
-            # Add counts to the frame
-            for text, position, color in text_positions:
-                cv2.putText(display_frame, text, position,
-                            cv2.FONT_HERSHEY_SIMPLEX, 1, color, 2)
+                # Post-process detections to map them back to the original frame
+                detections = postprocess_detections(pred, self.letterbox)
+
+                if self.roi_filter is None or self.roi_filter.size != original_size:
+                    self.roi_filter = RoiFilter(
+                        self.stream.roi_polygon, original_size, self.model.names)
+                # Only vehicle classes are tracked
+                tracks = self.tracker.update(detections[self.roi_filter.vehicles(detections)])
+            elif static:
+                # Nothing moved in the ROI: vehicles stay where they are
+                tracks = self.tracker.tracks()
+            else:
+                tracks = self.tracker.predict()
+
+            # Keep tracks whose center is inside the ROI, counted per class
+            kept, columns, counts = self.roi_filter.apply(tracks)
+            self.stream.current_counts = VehicleCounts.fromArray(counts)
+            if run_detection:
+                self.schedule.update(len(kept))
+
+            # Each track is counted once, the first time it is seen inside the ROI
+            track_ids = kept[:, 4].astype(np.int64)
+            new_vehicles = np.array([track_id not in self.counted_ids for track_id in track_ids], dtype=bool)
+            self.counted_ids.update(track_ids[new_vehicles].tolist())
+            self.counted_ids &= self.tracker.activeIds()
+
+            # All new vehicles of this frame go out in one message
+            events = []
+
+            for column in columns[new_vehicles]:
+                vehicle_class = VEHICLE_CLASSES[column]
+                # Randomly set willTurn
+                will_turn = random.choice([0, 1, 2])
+                if (will_turn != 1):
+                    lane = 2
+                elif (vehicle_class != 'motorcycle'):
+                    lane = random.choice([1, 2])
+                else:
+                    lane = 0  # Motorcycles use lane 0
+                # Create detection data
+                events.append({
+                    "direction": self.stream.camNumber,  # This could be updated based on your needs
+                    "lane": lane,
+                    "vehicleClass": vehicle_class,
+                    "turn": will_turn,
+                    "label": self.stream.label,
+                })
+
+            # Send data to WebSocket server
+            postprocessed = time.perf_counter()
+            self.sender.publish(events)
+            published = time.perf_counter()
+            if run_detection:
+                self.stream.observe("postprocess", postprocessed - detected)
+            self.stream.observe("publish", published - postprocessed)
+            if self.stream.frame_time is not None:
+                self.stream.observe("latency", published - self.stream.frame_time)
+            for event in events:
+                VEHICLES.inc(stream=label, vehicle_class=event["vehicleClass"])
+
+            # Update total counts with the vehicles seen for the first time
+            total_counts = self.stream.total_counts.toArray() + \
+                np.bincount(columns[new_vehicles], minlength=len(VEHICLE_CLASSES))
+            self.stream.total_counts = VehicleCounts.fromArray(total_counts)
+
+            # Nothing is drawn in headless mode unless the sink wants a frame
+            sink_due = self.sink is not None and self.sink.due(self.stream.label)
+            if self.headless and not sink_due:
+                continue
+            # The frame is ours (capture hands out a new array per frame), draw on it directly
+            self.annotate(frame, kept, columns)
+            if sink_due:
+                self.sink.put(self.stream.label, frame)
+            if self.headless:
+                continue
 
             # Display result
             cv2.imshow(
-                f'Vehicle Detection - {self.stream.label}', display_frame)
+                f'Vehicle Detection - {self.stream.label}', frame)
 
             if cv2.waitKey(1) & 0xFF == ord('q'):
                 # Red text
                 print(f'\033[91mThread for {self.stream.label} stopped\033[0m')
                 break
 
+        self.stream.stopCapture()
+        if self.stream.timings is not None:
+            self.stream.timings.finished = time.perf_counter()
+        if self.stream.capture_mode == "latest":
+            print(f'{self.stream.label} dropped {self.stream.dropped_frames} stale frames')
+        print(f'{self.stream.label} skipped detection on {self.skip_ratio:.0%} of frames')
+
+    # Share of frames that didn't go through the detector (schedule or motion gate)
+    @property
+    def skip_ratio(self) -> float:
+        return 1 - self.detected_frames / self.frames if self.frames else 0.0
+
+
+
+def get_options():
+    optParser = optparse.OptionParser()
+    optParser.add_option(
+        "-c",
+        "--config",
+        dest="config",
+        type="string",
+        default=CONFIG_PATH,
+        help="camera config file (JSON or YAML)",
+    )
+    optParser.add_option(
+        "--headless",
+        action="store_true",
+        default=False,
+        help="no windows and no drawing, only counts and events",
+    )
+    optParser.add_option(
+        "--snapshot-dir",
+        dest="snapshot_dir",
+        type="string",
+        default=None,
+        help="write an annotated JPEG per stream to this directory",
+    )
+    optParser.add_option(
+        "--mjpeg-port",
+        dest="mjpeg_port",
+        type="int",
+        default=None,
+        help="serve annotated frames as MJPEG on this port",
+    )
+    optParser.add_option(
+        "--snapshot-interval",
+        dest="snapshot_interval",
+        type="float",
+        default=SINK_INTERVAL,
+        help="seconds between two annotated frames of a stream",
+    )
+    optParser.add_option(
+        "--backend",
+        dest="backend",
+        type="choice",
+        choices=["torch", "onnx"],
+        default=None,
+        help="detector backend, overrides the config file",
+    )
+    optParser.add_option(
+        "-w",
+        "--workers",
+        dest="workers",
+        type="int",
+        default=1,
+        help="number of detection processes, streams are sharded across them",
+    )
+    optParser.add_option(
+        "--metrics-port",
+        dest="metrics_port",
+        type="int",
+        default=0,
+        help=f"serve Prometheus metrics on this port, e.g. {METRICS_PORT} (worker i uses port + i), off by default",
+    )
+    optParser.add_option(
+        "--log-level",
+        dest="log_level",
+        type="choice",
+        choices=["debug", "info", "warning", "error"],
+        default="info",
+        help="log level, repeated messages are rate limited",
+    )
+
+    options, args = optParser.parse_args()
+    return options
+
+
+def load_config(path: str) -> dict:
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            import yaml  # type: ignore
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def save_config(path: str, config: dict):
+    # Write next to the original and swap, so a crash never leaves half a config
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        if path.endswith((".yaml", ".yml")):
+            import yaml  # type: ignore
+            yaml.safe_dump(config, f, sort_keys=False)
+        else:
+            json.dump(config, f, indent=4)
+            f.write("\n")
+    os.replace(temp_path, path)
+
+
+def streams_from_config(config: dict) -> List[Stream]:
+    streams = []
+    cameras = [camera for camera in config["cameras"] if camera.get("enabled", True)]
+    for i, camera in enumerate(cameras):
+        # "motion": false turns the motion gate off, {} uses the defaults
+        motion = camera.get("motion", {})
+        stream = Stream(camera["url"], camera["type"],
+                        camera.get("label", f"Camera@{generate_random_string()}"),
+                        [tuple(point) for point in camera.get("roi", [])],
+                        camera.get("capture_mode", "latest"),
+                        camera.get("poll_interval", SNAPSHOT_POLL_INTERVAL),
+                        camera.get("decode_scale", 1),
+                        None if motion is False else motion,
+                        camera.get("schedule", {}),
+                        camera.get("frame_stride", 1),
+                        camera.get("quality", STREAM_QUALITY),
+                        camera.get("hwaccel", False))
+        stream.camNumber = camera.get("camNumber", i % 4)
+        streams.append(stream)
+    return streams
+
+
+# Write the ROIs selected at startup back to the config so they're only clicked once
+def save_rois(path: str, config: dict, streams: List[Stream]):
+    by_label = {stream.label: stream for stream in streams}
+    for camera in config["cameras"]:
+        stream = by_label.get(camera.get("label"))
+        if stream is not None and stream.roi_points:
+            camera["roi"] = [[int(x), int(y)] for x, y in stream.roi_points]
+    save_config(path, config)
+
+
+# Grab a first frame from every camera at once, cameras that fail or take longer
+# than timeout are skipped. Returns (stream, first frame) pairs in config order.
+def validate_streams(streams: List[Stream], timeout: float = STARTUP_TIMEOUT):
+    if not streams:
+        return []
+    executor = ThreadPoolExecutor(len(streams), thread_name_prefix="validate")
+    futures = [executor.submit(stream.getFrame, max_retries=1) for stream in streams]
+    done, _ = wait(futures, timeout)
+    executor.shutdown(wait=False)
+
+    validated = []
+    for stream, future in zip(streams, futures):
+        if future in done and future.exception() is None:
+            ret, frame = future.result()
+            if ret and frame is not None:
+                validated.append((stream, frame))
+                continue
+        print(f'\033[91mSkipping {stream.label}: no frame from {stream.url}\033[0m')
+    print(f'\033[92m{len(validated)}/{len(streams)} cameras ready\033[0m')
+    return validated
+
+
+# Detection threads for a set of streams sharing one model, blocks until they all stop
+# Returns the labels of the streams whose thread died of an exception
+def run_streams(streams: List[Stream], model, options, sink=None, sender=None) -> List[str]:
+    # One batched forward pass per tick for all streams
+    scheduler = InferenceScheduler(model)
+    scheduler.start()
+
+    # Shared websocket connection for all streams
+    own_sender = sender is None
+    if own_sender:
+        sender = DetectionSender()
+        sender.start()
+
+    # "image" cameras are polled together instead of one request per thread
+    poller = SnapshotPoller()
+
+    # Create and start threads for each stream
+    threads = []
+    for stream in streams:
+        stream.setROI_Polygon()
+        if stream.type == "image":
+            poller.register(stream)
+        threads.append(StreamThread(stream, model, sender, scheduler,
+                                    headless=options.headless, sink=sink))
+
+    poller.start()
+
+    # Start all threads
+    for thread in threads:
+        print(f'\033[94mStarting thread for {thread.stream.label}\033[0m')
+        thread.start()
+
+    # Wait for all threads to finish
+    for thread in threads:
+        print(
+            f'\033[93mWaiting for thread {thread.stream.label} to finish\033[0m')
+        thread.join()
+
+    scheduler.stop()
+    poller.stop()
+    if own_sender:
+        sender.stop()
+
+    # Release resources. Readers release their own capture, as a read still in
+    # progress (a stalled camera) can outlast the timeout.
+    for stream in streams:
+        if stream.reader is not None:
+            stream.reader.join(READER_STOP_TIMEOUT)
+        elif stream.cap is not None:
+            stream.cap.release()
+    return [thread.stream.label for thread in threads if thread.failed]
+
+
+# Entry point of a worker process: its own model and threads for one shard of the streams.
+# Total counts are reported to the supervisor over counts_queue.
+def worker_main(worker_id: int, generation: int, specs: List[dict], counts_queue, options,
+                torch_threads: int):
+    import torch
+    torch.set_num_threads(torch_threads)
+    torch.set_num_interop_threads(1)
+    cv2.setNumThreads(1)
+
+    setup_logging(options.log_level)
+    if options.metrics_port:
+        MetricsServer(options.metrics_port + worker_id)
+
+    streams = [Stream.fromSpec(spec) for spec in specs]
+    sink = None
+    if options.snapshot_dir is not None or options.mjpeg_port is not None:
+        port = options.mjpeg_port + worker_id if options.mjpeg_port is not None else None
+        sink = AnnotatedFrameSink(options.snapshot_interval, options.snapshot_dir, port)
+
+    def report():
+        while True:
+            for stream in streams:
+                counts_queue.put((worker_id, generation, stream.label, vars(stream.total_counts).copy()))
+            time.sleep(WORKER_REPORT_INTERVAL)
+
+    threading.Thread(target=report, name="report", daemon=True).start()
+    model = load_detector(options.detector, torch_threads)
+    failed = run_streams(streams, model, options, sink)
+    for stream in streams:
+        counts_queue.put((worker_id, generation, stream.label, vars(stream.total_counts).copy()))
+    # A non-zero exit makes the supervisor restart the shard
+    if failed:
+        log.error("Worker %d: %s died", worker_id, ", ".join(failed))
+        sys.exit(1)
+
+
+# Shards the streams across worker processes, restarts workers that crash and
+# aggregates the counts they report
+class WorkerSupervisor:
+    def __init__(self, streams: List[Stream], num_workers: int, options):
+        self.options = options
+        self.context = multiprocessing.get_context("spawn")
+        self.counts_queue = self.context.Queue()
+        self.shards = [[stream.spec() for stream in streams[i::num_workers]]
+                       for i in range(num_workers)]
+        self.shards = [shard for shard in self.shards if shard]
+        # Size torch's pool so the workers together don't oversubscribe the CPU
+        self.torch_threads = max(1, (os.cpu_count() or 1) // len(self.shards))
+        self.processes = [None] * len(self.shards)
+        self.restarts = [0] * len(self.shards)
+        self.restart_at = [0.0] * len(self.shards)
+        self.finished = set()
+        # Counts reported by the current process of a worker, plus what earlier
+        # (crashed) processes had counted for the same stream
+        self.counts = {}
+        self.base_counts = {}
+
+    def startWorker(self, worker_id: int):
+        process = self.context.Process(
+            target=worker_main, name=f"detection-worker-{worker_id}",
+            args=(worker_id, self.restarts[worker_id], self.shards[worker_id], self.counts_queue,
+                  self.options, self.torch_threads))
+        process.start()
+        self.processes[worker_id] = process
+        print(f'\033[94mStarted worker {worker_id} (pid {process.pid}) for '
+              f'{", ".join(spec["label"] for spec in self.shards[worker_id])}\033[0m')
+
+    def totals(self) -> dict:
+        totals = {}
+        for label in set(self.counts) | set(self.base_counts):
+            current = self.counts.get(label, {})
+            base = self.base_counts.get(label, {})
+            totals[label] = {name: current.get(name, 0) + base.get(name, 0)
+                             for name in VEHICLE_CLASSES}
+        return totals
+
+    def crashed(self, worker_id: int):
+        for spec in self.shards[worker_id]:
+            label = spec["label"]
+            current = self.counts.pop(label, {})
+            base = self.base_counts.setdefault(label, {})
+            for name, count in current.items():
+                base[name] = base.get(name, 0) + count
+        delay = min(WORKER_RESTART_DELAY * 2 ** self.restarts[worker_id], WORKER_MAX_RESTART_DELAY)
+        self.restarts[worker_id] += 1
+        self.restart_at[worker_id] = time.monotonic() + delay
+        self.processes[worker_id] = None
+        print(f'\033[91mWorker {worker_id} crashed, restarting in {delay}s\033[0m')
+
+    def run(self):
+        for worker_id in range(len(self.shards)):
+            self.startWorker(worker_id)
+
+        last_summary = time.monotonic()
+        while len(self.finished) < len(self.shards):
+            try:
+                worker_id, generation, label, counts = self.counts_queue.get(timeout=1)
+                # Late reports of a crashed process are already in base_counts
+                if generation == self.restarts[worker_id]:
+                    self.counts[label] = counts
+            except queue.Empty:
+                pass
+
+            for worker_id, process in enumerate(self.processes):
+                if worker_id in self.finished:
+                    continue
+                if process is None:
+                    if time.monotonic() >= self.restart_at[worker_id]:
+                        self.startWorker(worker_id)
+                elif not process.is_alive():
+                    if process.exitcode == 0:
+                        self.finished.add(worker_id)
+                    else:
+                        self.crashed(worker_id)
+
+            if time.monotonic() - last_summary >= WORKER_REPORT_INTERVAL:
+                last_summary = time.monotonic()
+                for label, counts in sorted(self.totals().items()):
+                    print(f"{label}: {counts}")
+
+    def stop(self):
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+
+
+def main():
+    options = get_options()
+    setup_logging(options.log_level)
+
+    # Worker processes only run headless
+    if options.workers > 1:
+        options.headless = True
+
+    sink = None
+    if options.workers <= 1 and (options.snapshot_dir is not None or options.mjpeg_port is not None):
+        sink = AnnotatedFrameSink(options.snapshot_interval, options.snapshot_dir, options.mjpeg_port)
+
+    config = load_config(options.config)
+    options.detector = config.get("detector", {})
+    if options.backend is not None:
+        options.detector["backend"] = options.backend
+    validated = validate_streams(streams_from_config(config))
+    streams = [stream for stream, _ in validated]
+
+    # ROIs are selected here so workers never need a display
+    selected = False
+    for stream, frame in validated:
+        if (stream.roi_points == []):
+            if options.headless:
+                # Nobody to click, count over the whole frame until an ROI is configured
+                height, width = frame.shape[:2]
+                stream.roi_points = [(0, 0), (width - 1, 0), (width - 1, height - 1), (0, height - 1)]
+                print(f'\033[93mNo ROI configured for {stream.label}, using the full frame\033[0m')
+            else:
+                stream.selectROI(frame)
+                selected = True
+    if selected:
+        save_rois(options.config, config, streams)
+
+    if options.workers > 1:
+        for stream in streams:
+            if stream.cap is not None:
+                stream.cap.release()
+                stream.cap = None
+        supervisor = WorkerSupervisor(streams, options.workers, options)
+        try:
+            supervisor.run()
+        finally:
+            supervisor.stop()
+        return
+
+    if options.metrics_port:
+        MetricsServer(options.metrics_port)
+
+    # Load YOLO model
+    model = load_detector(options.detector)
+    failed = run_streams(streams, model, options, sink)
+
+    if sink is not None:
+        sink.stop()
+    if not options.headless:
+        cv2.destroyAllWindows()
+    if failed:
+        sys.exit(1)
+
 
-# Define streams
-stream1 = Stream(
-    "https://www.youtube.com/watch?v=oz46g45u80k", "youtube", "YouTube")
-stream2 = Stream(
-    "http://81.60.215.31/cgi-bin/viewer/video.jpg", "image", "Image")
-stream3 = Stream("http://181.57.169.89:8080/mjpg/video.mjpg",
-                 "mjpg", "MJPG")  # Bogota,Columbia
-stream4 = Stream("http://31.173.125.161:82/mjpg/video.mjpg",
-                 "mjpg", "MJPG1")   # Russia
-stream5 = Stream(
-    "http://86.121.159.16/cgi-bin/faststream.jpg?stream=half&fps=15&rand=COUNTER", "mjpg", "MJPG2",)
-_stream6 = Stream("http://185.137.146.14:80/mjpg/video.mjpg", "mjpg", "MJPG3")
-_stream7 = Stream(
-    "http://79.10.24.158:80/cgi-bin/faststream.jpg?stream=half&fps=15&rand=COUNTER", "mjpg", "MJPG4")
-stream8 = Stream(
-    "http://72.24.198.180:80/cgi-bin/faststream.jpg?stream=half&fps=15&rand=COUNTER", "mjpg", "MJPG5")
-stream9 = Stream("http://125.17.248.94:8080/cgi-bin/viewer/video.jpg",
-                 "image", "Image1")  # Mumbai
-stream10 = Stream(
-    "http://50.252.166.122:80/cgi-bin/faststream.jpg?stream=half&fps=15&rand=COUNTER", "mjpg", "MJPG6")
-stream11 = Stream("http://82.76.145.217:80/cgi-bin/faststream.jpg?stream=half&fps=15&rand=COUNTER",
-                  "mjpg", "MJPG7")  # Heavy traffic
-stream12 = Stream("http://80.160.138.86:80/mjpg/video.mjpg",
-                   "mjpg", "MJPG8")  # Jakarta
-stream13 = Stream("http://103.217.216.197:8001/jpg/image.jpg",
-                  "image", "Image2")  # Bekasi, Indonesia
-stream14 = Stream("http://90.146.10.190:80/mjpg/video.mjpg",
-                  "mjpg", "MJPG9")  # Linz, Austria
-stream15 = Stream(
-    "http://210.166.46.180:80/-wvhttp-01-/GetOneShot?image_size=640x480&frame_count=1000000000", "mjpg", "MJPG10")  # Tokyo, Japan
-stream16 = Stream(
-    "http://175.138.229.49:8082/cgi-bin/viewer/video.jpg?r=1725431504", "image", "Image3")
-
-streamCandidates = [stream3,stream4,stream5,stream8,stream9,stream10,stream11,stream12,stream13,stream14,stream16]
-
-streams:list[Stream] = []  # Use 4 streams at maximum
-
-# Load YOLO model
-model = yolov5.load('./yolov5s.pt')
-
-# Create and start threads for each stream
-threads = []
-for i in range(len(streams)):
-    streams[i].camNumber = i % 4
-    if (streams[i].roi_points == []):
-        streams[i].selectROI()
-    streams[i].setROI_Polygon()
-    threads.append(StreamThread(streams[i], model))
-
-# Start all threads
-for thread in threads:
-    print(f'\033[94mStarting thread for {thread.stream.label}\033[0m')
-    thread.start()
-
-# Wait for all threads to finish
-for thread in threads:
-    print(
-        f'\033[93mWaiting for thread {thread.stream.label} to finish\033[0m')
-    thread.join()
-
-# Release resources
-for stream in streams:
-    if stream.cap is not None:
-        stream.cap.release()
-cv2.destroyAllWindows()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import re
+from typing import Optional
+
+import cv2
+import numpy as np
+import requests
+import urllib3
+import streamlink
+
+# Cheaper decode paths for Stream sources:
+#   "mjpg":    the multipart stream is split into JPEGs ourselves, so skipped frames are
+#              never decoded and the rest are decoded straight at 1/2, 1/4 or 1/8 scale
+#              (libjpeg-turbo DCT scaling) instead of full size and then resized
+#   "youtube": a lower HLS variant than "best", optional hardware decode, and a frame
+#              stride that grab()s the frames in between without converting them to BGR
+
+STREAM_QUALITY = "best"       # streamlink variant ("best", "worst", "480p", ...)
+MJPEG_CHUNK_SIZE = 64 * 1024  # most bytes taken from the socket at once
+MJPEG_READ_SIZE = 4096        # fixed read size when urllib3 has no read1 (< 2.0)
+MJPEG_TIMEOUT = 10            # seconds to connect and between two chunks
+MJPEG_MAX_BUFFER = 8 * 1024 * 1024  # bytes buffered looking for the end of a JPEG
+
+IMREAD_FLAGS = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+                4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+CONTENT_LENGTH = re.compile(rb"content-length:\s*(\d+)", re.IGNORECASE)
+
+
+# A JPEG that's only decoded when detection actually takes it, so frames the
+# latest-frame reader replaces before they're read never cost a decode
+class EncodedFrame:
+    __slots__ = ("data", "scale")
+
+    def __init__(self, data: bytes, scale: int = 1):
+        self.data = data
+        self.scale = scale
+
+    def decode(self) -> Optional[np.ndarray]:
+        return cv2.imdecode(np.frombuffer(self.data, dtype=np.uint8), IMREAD_FLAGS[self.scale])
+
+
+class MjpegReader:
+    def __init__(self, url: str, scale: int = 1, stride: int = 1, timeout: float = MJPEG_TIMEOUT):
+        self.scale = scale
+        self.stride = stride
+        self.response = requests.get(url, stream=True, timeout=timeout)
+        self.response.raise_for_status()
+        self.buffer = bytearray()
+        self.frames = 0
+
+    # Whatever arrived so far: a fixed size read would hold a frame back until
+    # the next ones filled the chunk
+    def fill(self) -> bool:
+        raw = self.response.raw
+        if hasattr(raw, "read1"):
+            chunk = raw.read1(MJPEG_CHUNK_SIZE)
+        else:
+            chunk = raw.read(MJPEG_READ_SIZE)
+        if not chunk or len(self.buffer) > MJPEG_MAX_BUFFER:
+            return False
+        self.buffer += chunk
+        return True
+
+    # Next JPEG of the stream. Parts are cut by their Content-Length header when the
+    # camera sends one, otherwise at the end-of-image marker.
+    def nextJpeg(self) -> Optional[bytes]:
+        while True:
+            start = self.buffer.find(b"\xff\xd8")
+            if start >= 0:
+                length = CONTENT_LENGTH.search(self.buffer, 0, start)
+                if length is not None:
+                    end = start + int(length.group(1))
+                    if len(self.buffer) >= end:
+                        jpeg = bytes(self.buffer[start:end])
+                        del self.buffer[:end]
+                        return jpeg
+                else:
+                    end = self.buffer.find(b"\xff\xd9", start + 2)
+                    if end >= 0:
+                        jpeg = bytes(self.buffer[start:end + 2])
+                        del self.buffer[:end + 2]
+                        return jpeg
+            if not self.fill():
+                return None
+
+    def read(self, encoded: bool = False):
+        try:
+            # Frames in between are skipped without being decoded
+            for _ in range(self.stride - 1):
+                if self.nextJpeg() is None:
+                    return (False, None)
+            jpeg = self.nextJpeg()
+        except (requests.RequestException, OSError, urllib3.exceptions.HTTPError):
+            return (False, None)
+        if jpeg is None:
+            return (False, None)
+        self.frames += 1
+        frame = EncodedFrame(jpeg, self.scale)
+        if encoded:
+            return (True, frame)
+        image = frame.decode()
+        return (image is not None, image)
+
+    def release(self):
+        self.response.close()
+
+
+# Stream URL of the requested variant. A height like "480p" that isn't offered
+# falls back to the highest variant below it, then to the lowest one.
+def select_stream_url(url: str, quality: str = STREAM_QUALITY) -> Optional[str]:
+    try:
+        streams = streamlink.streams(url)
+    except streamlink.exceptions.StreamlinkError:
+        return None
+    if not streams:
+        return None
+    if quality in streams:
+        return streams[quality].url
+    heights = {name: int(match.group(1)) for name in streams
+               for match in [re.match(r"(\d+)p", name)] if match}
+    target = re.match(r"(\d+)p", quality)
+    if target and heights:
+        below = [name for name, height in heights.items() if height <= int(target.group(1))]
+        if below:
+            return streams[max(below, key=heights.get)].url
+    return streams["worst" if "worst" in streams else "best"].url
+
+
+def open_video(url: str, hwaccel: bool = False) -> cv2.VideoCapture:
+    # Needs OpenCV >= 4.5.2 built with FFmpeg; falls back to software decode
+    if hwaccel and hasattr(cv2, "CAP_PROP_HW_ACCELERATION"):
+        cap = cv2.VideoCapture(url, cv2.CAP_FFMPEG,
+                               [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY])
+        if cap.isOpened():
+            return cap
+    return cv2.VideoCapture(url)
+
+
+# Every stride-th frame of a video: the ones in between are only grab()bed,
+# which skips their BGR conversion and copy (and the download from the GPU)
+def read_stride(cap: cv2.VideoCapture, stride: int = 1):
+    for _ in range(stride - 1):
+        if not cap.grab():
+            return (False, None)
+    return cap.read()
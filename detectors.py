@@ -0,0 +1,290 @@
+import ast
+import json
+import optparse
+import os
+import time
+from abc import ABC, abstractmethod
+from typing import List, Optional
+
+import cv2
+import numpy as np
+
+# Detector backends behind StreamThread. A detector takes a batch of letterboxed
+# size x size frames and returns one (N, 6) array per frame:
+#   x1, y1, x2, y2, confidence, class_id   (in letterboxed frame coordinates)
+# Backends are picked by the "detector" section of the camera config:
+#   {"backend": "torch" | "onnx", "weights": "./yolov5s.pt", "onnx": "./yolov5s.onnx",
+#    "int8": false, "size": 640}
+
+WEIGHTS_PATH = './yolov5s.pt'
+DETECTOR_SIZE = 640
+CONF_THRESHOLD = 0.25  # same defaults as yolov5's AutoShape
+IOU_THRESHOLD = 0.45
+MAX_DETECTIONS = 1000
+MAX_WH = 7680          # class offset so one NMS pass keeps classes apart
+
+
+class Detector(ABC):
+    names: dict
+    size: int
+
+    @abstractmethod
+    def __call__(self, frames: List[np.ndarray]) -> List[np.ndarray]:
+        pass
+
+
+class TorchDetector(Detector):
+    def __init__(self, weights: str = WEIGHTS_PATH, size: int = DETECTOR_SIZE):
+        import yolov5  # type: ignore
+        self.model = yolov5.load(weights)
+        self.names = dict(enumerate(self.model.names)) if isinstance(self.model.names, list) else self.model.names
+        self.size = size
+
+    def __call__(self, frames):
+        results = self.model(frames, size=self.size)
+        return [pred.cpu().numpy() for pred in results.pred]
+
+
+def nms(boxes, scores, iou_threshold):
+    order = scores.argsort()[::-1]
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        x1 = np.maximum(boxes[i, 0], boxes[order[1:], 0])
+        y1 = np.maximum(boxes[i, 1], boxes[order[1:], 1])
+        x2 = np.minimum(boxes[i, 2], boxes[order[1:], 2])
+        y2 = np.minimum(boxes[i, 3], boxes[order[1:], 3])
+        intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+        iou = intersection / (areas[i] + areas[order[1:]] - intersection + 1e-6)
+        order = order[1:][iou <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+# Same filtering as yolov5's non_max_suppression for one image of raw
+# (N, 5 + classes) output rows: cx, cy, w, h, objectness, class scores...
+def postprocess_raw(rows, conf_threshold=CONF_THRESHOLD, iou_threshold=IOU_THRESHOLD,
+                    max_detections=MAX_DETECTIONS):
+    rows = rows[rows[:, 4] > conf_threshold]
+    if not len(rows):
+        return np.zeros((0, 6), np.float32)
+    scores = rows[:, 5:] * rows[:, 4:5]
+    class_ids = scores.argmax(1)
+    confidences = scores[np.arange(len(rows)), class_ids]
+    mask = confidences > conf_threshold
+    rows, class_ids, confidences = rows[mask], class_ids[mask], confidences[mask]
+
+    boxes = np.empty((len(rows), 4), np.float32)
+    boxes[:, 0] = rows[:, 0] - rows[:, 2] / 2
+    boxes[:, 1] = rows[:, 1] - rows[:, 3] / 2
+    boxes[:, 2] = rows[:, 0] + rows[:, 2] / 2
+    boxes[:, 3] = rows[:, 1] + rows[:, 3] / 2
+    keep = nms(boxes + class_ids[:, None] * MAX_WH, confidences, iou_threshold)[:max_detections]
+    return np.concatenate([boxes[keep], confidences[keep, None], class_ids[keep, None]], axis=1).astype(np.float32)
+
+
+# yolov5 exported to ONNX (with a dynamic batch axis) run through onnxruntime.
+# The OpenVINO execution provider is used when onnxruntime-openvino is installed.
+class OnnxDetector(Detector):
+    def __init__(self, path: str, size: int = DETECTOR_SIZE, names: Optional[dict] = None,
+                 threads: Optional[int] = None):
+        import onnxruntime as ort  # type: ignore
+        options = ort.SessionOptions()
+        if threads is not None:
+            options.intra_op_num_threads = threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        providers = [provider for provider in ("OpenVINOExecutionProvider", "CPUExecutionProvider")
+                     if provider in ort.get_available_providers()]
+        self.session = ort.InferenceSession(path, options, providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+        self.size = size
+        if names is None:
+            # yolov5's exporter stores the class names in the model metadata
+            names = ast.literal_eval(self.session.get_modelmeta().custom_metadata_map["names"])
+        self.names = names
+
+    def __call__(self, frames):
+        batch = np.stack(frames).transpose(0, 3, 1, 2).astype(np.float32) / 255
+        output = self.session.run(None, {self.input_name: batch})[0]
+        return [postprocess_raw(rows) for rows in output]
+
+
+def export_onnx(weights: str = WEIGHTS_PATH, size: int = DETECTOR_SIZE, int8: bool = False) -> str:
+    from yolov5.export import run as export_run  # type: ignore
+    onnx_path = os.path.splitext(weights)[0] + ".onnx"
+    export_run(weights=weights, include=("onnx",), imgsz=(size, size), dynamic=True, simplify=True)
+    if not int8:
+        return onnx_path
+    # Dynamic quantization: INT8 weights, activations quantized on the fly
+    from onnxruntime.quantization import QuantType, quantize_dynamic  # type: ignore
+    int8_path = os.path.splitext(weights)[0] + ".int8.onnx"
+    quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QUInt8)
+    return int8_path
+
+
+def load_detector(settings: Optional[dict] = None, threads: Optional[int] = None) -> Detector:
+    settings = settings or {}
+    backend = settings.get("backend", "torch")
+    weights = settings.get("weights", WEIGHTS_PATH)
+    size = settings.get("size", DETECTOR_SIZE)
+    if backend == "torch":
+        return TorchDetector(weights, size)
+    if backend == "onnx":
+        int8 = settings.get("int8", False)
+        path = settings.get("onnx") or os.path.splitext(weights)[0] + (".int8.onnx" if int8 else ".onnx")
+        if not os.path.exists(path):
+            print(f"\033[93mExporting {weights} to {path}\033[0m")
+            path = export_onnx(weights, size, int8)
+        return OnnxDetector(path, size, threads=threads)
+    raise ValueError(f"Unknown detector backend: {backend}")
+
+
+# Benchmark
+
+def load_clip_frames(clips_dir: str, frames_per_clip: int) -> List[np.ndarray]:
+    frames = []
+    for name in sorted(os.listdir(clips_dir)):
+        path = os.path.join(clips_dir, name)
+        if name.lower().endswith((".jpg", ".jpeg", ".png")):
+            frames.append(cv2.imread(path))
+            continue
+        cap = cv2.VideoCapture(path)
+        count = 0
+        while count < frames_per_clip:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+            count += 1
+        cap.release()
+    return [frame for frame in frames if frame is not None]
+
+
+def average_precision(predictions: List[np.ndarray], references: List[np.ndarray], iou_threshold=0.5):
+    from tracker import iou_matrix
+    class_ids = set()
+    for reference in references:
+        class_ids.update(reference[:, 5].astype(int).tolist())
+    aps = []
+    for class_id in class_ids:
+        scores, matched, total = [], [], 0
+        for prediction, reference in zip(predictions, references):
+            prediction = prediction[prediction[:, 5] == class_id]
+            reference = reference[reference[:, 5] == class_id]
+            total += len(reference)
+            prediction = prediction[prediction[:, 4].argsort()[::-1]]
+            used = np.zeros(len(reference), bool)
+            iou = iou_matrix(prediction[:, :4], reference[:, :4]) if len(reference) else None
+            for i in range(len(prediction)):
+                scores.append(prediction[i, 4])
+                hit = False
+                if iou is not None:
+                    candidates = np.where((iou[i] >= iou_threshold) & ~used)[0]
+                    if len(candidates):
+                        used[candidates[iou[i, candidates].argmax()]] = True
+                        hit = True
+                matched.append(hit)
+        if total == 0:
+            continue
+        order = np.argsort(scores)[::-1]
+        hits = np.array(matched, dtype=float)[order]
+        true_positives = np.cumsum(hits)
+        recall = true_positives / total
+        precision = true_positives / np.arange(1, len(hits) + 1)
+        # All-point interpolated area under the precision/recall curve
+        recall = np.concatenate([[0], recall, [1]])
+        precision = np.concatenate([[1], precision, [0]])
+        precision = np.maximum.accumulate(precision[::-1])[::-1]
+        aps.append(np.sum((recall[1:] - recall[:-1]) * precision[1:]))
+    return float(np.mean(aps)) if aps else 1.0
+
+
+# Latency of every backend on the same frames and the mAP@0.5 of its detections
+# against the PyTorch backend's, which shows how far an export/quantization drifts
+def benchmark(clips_dir: str, backends: List[dict], frames_per_clip: int = 50, warmup: int = 3):
+    from car_detection import Letterbox
+    frames = load_clip_frames(clips_dir, frames_per_clip)
+    if not frames:
+        raise SystemExit(f"No images or videos found in {clips_dir}")
+
+    report = {}
+    reference = None
+    for settings in backends:
+        name = settings.get("name", settings.get("backend", "torch"))
+        detector = load_detector(settings)
+        letterbox = Letterbox(detector.size)
+        inputs = [letterbox(frame).copy() for frame in frames]
+        for frame in inputs[:warmup]:
+            detector([frame])
+
+        latencies, predictions = [], []
+        for frame in inputs:
+            start = time.perf_counter()
+            predictions.append(detector([frame])[0])
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        if reference is None:
+            reference = predictions
+        report[name] = {
+            "frames": len(inputs),
+            "mean_ms": float(np.mean(latencies)),
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+            "map50_vs_reference": average_precision(predictions, reference),
+        }
+        print(f"{name:>12}: {report[name]['mean_ms']:.1f} ms mean, {report[name]['p95_ms']:.1f} ms p95, "
+              f"mAP@0.5 vs {backends[0].get('name', 'torch')}: {report[name]['map50_vs_reference']:.3f}")
+    return report
+
+
+def get_options():
+    optParser = optparse.OptionParser(usage="%prog [options] CLIPS_DIR")
+    optParser.add_option(
+        "--weights",
+        dest="weights",
+        type="string",
+        default=WEIGHTS_PATH,
+        help="yolov5 weights",
+    )
+    optParser.add_option(
+        "--size",
+        dest="size",
+        type="int",
+        default=DETECTOR_SIZE,
+        help="inference resolution",
+    )
+    optParser.add_option(
+        "-n",
+        dest="frames_per_clip",
+        type="int",
+        default=50,
+        help="frames read from every video",
+    )
+    optParser.add_option(
+        "-o",
+        dest="output",
+        type="string",
+        default=None,
+        help="write the results as JSON",
+    )
+
+    options, args = optParser.parse_args()
+    if len(args) != 1:
+        optParser.error("expected the directory of benchmark clips")
+    return options, args[0]
+
+
+# this is the main entry point of this script
+if __name__ == "__main__":
+    options, clips_dir = get_options()
+    common = {"weights": options.weights, "size": options.size}
+    backends = [
+        dict(common, name="torch", backend="torch"),
+        dict(common, name="onnx", backend="onnx"),
+        dict(common, name="onnx-int8", backend="onnx", int8=True),
+    ]
+    report = benchmark(clips_dir, backends, options.frames_per_clip)
+    if options.output is not None:
+        with open(options.output, "w") as f:
+            json.dump(report, f, indent=4)
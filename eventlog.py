@@ -0,0 +1,229 @@
+import os
+import struct
+import time
+from bisect import bisect_left, bisect_right
+from typing import Iterator, List, Optional, Union
+
+# Append-only log of everything published to the relay, so consumers can catch up on
+# what they missed while disconnected and whole traffic episodes can be replayed.
+# Records get consecutive offsets from 0. The log is split into segments named after
+# the offset of their first record, and the oldest segments are deleted once there
+# are more than max_segments.
+#
+# Segment "<first offset>.log", records back to back (little endian):
+#   offset u64, timestamp f64, kind u8 (0 text, 1 binary), topic length u16,
+#   payload length u32, topic utf-8, payload
+# Index "<first offset>.idx", an entry for every INDEX_INTERVAL-th record of the segment:
+#   timestamp f64, offset u64, byte position in the segment u64
+
+SEGMENT_BYTES = 64 * 1024 * 1024  # a new segment is started once the current one is this big
+MAX_SEGMENTS = 16                 # segments kept on disk, the oldest are deleted
+INDEX_INTERVAL = 64               # records between two index entries
+
+RECORD = struct.Struct("<QdBHI")
+INDEX = struct.Struct("<dQQ")
+TEXT, BINARY = 0, 1
+
+
+class Record:
+    __slots__ = ("offset", "timestamp", "topic", "payload")
+
+    def __init__(self, offset: int, timestamp: float, topic: str, payload: Union[str, bytes]):
+        self.offset = offset
+        self.timestamp = timestamp
+        self.topic = topic
+        self.payload = payload
+
+
+class Segment:
+    def __init__(self, directory: str, base: int):
+        self.base = base
+        self.path = os.path.join(directory, f"{base:020d}.log")
+        self.index_path = os.path.join(directory, f"{base:020d}.idx")
+        self.timestamps: List[float] = []
+        self.offsets: List[int] = []
+        self.positions: List[int] = []
+        self.size = 0
+        self.next_offset = base
+
+    def addIndex(self, timestamp: float, offset: int, position: int):
+        self.timestamps.append(timestamp)
+        self.offsets.append(offset)
+        self.positions.append(position)
+
+    def loadIndex(self):
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, "rb") as f:
+            data = f.read()
+        for entry in INDEX.iter_unpack(data[:len(data) - len(data) % INDEX.size]):
+            self.addIndex(*entry)
+
+    # Byte position to start scanning from for offset
+    def position(self, offset: int) -> int:
+        i = bisect_right(self.offsets, offset) - 1
+        return self.positions[i] if i >= 0 else 0
+
+    # Finds the end of the last complete record and cuts off anything after it,
+    # left behind by a crash in the middle of an append
+    def recover(self) -> float:
+        self.loadIndex()
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        while self.positions and self.positions[-1] >= size:
+            for entries in (self.timestamps, self.offsets, self.positions):
+                entries.pop()
+        position = self.positions[-1] if self.positions else 0
+        last_timestamp = self.timestamps[-1] if self.timestamps else 0.0
+        missing = []
+        with open(self.path, "ab+") as f:
+            f.seek(position)
+            while True:
+                header = f.read(RECORD.size)
+                if len(header) < RECORD.size:
+                    break
+                offset, timestamp, _, topic_length, payload_length = RECORD.unpack(header)
+                length = RECORD.size + topic_length + payload_length
+                if position + length > size:
+                    break
+                if (offset - self.base) % INDEX_INTERVAL == 0 and offset not in self.offsets[-1:]:
+                    missing.append((timestamp, offset, position))
+                self.next_offset = offset + 1
+                last_timestamp = timestamp
+                position += length
+                f.seek(position)
+            f.truncate(position)
+        self.size = position
+        # Rewritten so it matches the truncated segment again
+        for entry in missing:
+            self.addIndex(*entry)
+        with open(self.index_path, "wb") as f:
+            for entry in zip(self.timestamps, self.offsets, self.positions):
+                f.write(INDEX.pack(*entry))
+        return last_timestamp
+
+    def remove(self):
+        for path in (self.path, self.index_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+# Written from a single thread (the relay's event loop); reads open their own file
+# handles and only return records that were completely written before they started
+class EventLog:
+    def __init__(self, directory: str, segment_bytes: int = SEGMENT_BYTES, max_segments: int = MAX_SEGMENTS):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max(1, max_segments)
+        os.makedirs(directory, exist_ok=True)
+
+        bases = sorted(int(name[:-4]) for name in os.listdir(directory)
+                       if name.endswith(".log") and name[:-4].isdigit())
+        self.segments = [Segment(directory, base) for base in bases] or [Segment(directory, 0)]
+        for segment, following in zip(self.segments, self.segments[1:]):
+            segment.loadIndex()
+            segment.next_offset = following.base
+        self.last_timestamp = self.segments[-1].recover()
+        self.open()
+
+    @property
+    def first_offset(self) -> int:
+        return self.segments[0].base
+
+    @property
+    def next_offset(self) -> int:
+        return self.segments[-1].next_offset
+
+    def open(self):
+        segment = self.segments[-1]
+        self.file = open(segment.path, "ab")
+        self.index_file = open(segment.index_path, "ab")
+
+    def close(self):
+        self.file.close()
+        self.index_file.close()
+
+    # Starts a new segment and deletes the ones past max_segments
+    def roll(self) -> Segment:
+        self.close()
+        segment = Segment(self.directory, self.next_offset)
+        self.segments.append(segment)
+        self.open()
+        while len(self.segments) > self.max_segments:
+            self.segments.pop(0).remove()
+        return segment
+
+    # Returns the offset of the new record
+    def append(self, topic: str, payload: Union[str, bytes], timestamp: Optional[float] = None) -> int:
+        segment = self.segments[-1]
+        if segment.size >= self.segment_bytes:
+            segment = self.roll()
+        # Kept non-decreasing so the index can be searched by time
+        timestamp = max(time.time() if timestamp is None else timestamp, self.last_timestamp)
+        kind, data = (BINARY, payload) if isinstance(payload, bytes) else (TEXT, payload.encode())
+        topic_data = topic.encode()
+        offset = segment.next_offset
+
+        self.file.write(RECORD.pack(offset, timestamp, kind, len(topic_data), len(data)) + topic_data + data)
+        self.file.flush()
+        if (offset - segment.base) % INDEX_INTERVAL == 0:
+            segment.addIndex(timestamp, offset, segment.size)
+            self.index_file.write(INDEX.pack(timestamp, offset, segment.size))
+            self.index_file.flush()
+        segment.size += RECORD.size + len(topic_data) + len(data)
+        segment.next_offset = offset + 1
+        self.last_timestamp = timestamp
+        return offset
+
+    # Records from offset start (or the oldest one still kept) up to end, at most limit of them
+    def read(self, start: int, end: Optional[int] = None, limit: Optional[int] = None) -> Iterator[Record]:
+        segments = list(self.segments)
+        end = self.next_offset if end is None else min(end, self.next_offset)
+        start = max(start, segments[0].base)
+        count = 0
+        first = max(bisect_right([segment.base for segment in segments], start) - 1, 0)
+        for segment in segments[first:]:
+            stop = min(end, segment.next_offset)
+            if start >= stop:
+                continue
+            try:
+                f = open(segment.path, "rb")
+            except FileNotFoundError:
+                # Deleted by a roll since
+                continue
+            with f:
+                f.seek(segment.position(start))
+                while True:
+                    header = f.read(RECORD.size)
+                    if len(header) < RECORD.size:
+                        break
+                    offset, timestamp, kind, topic_length, payload_length = RECORD.unpack(header)
+                    if offset >= stop:
+                        break
+                    if offset < start:
+                        f.seek(topic_length + payload_length, os.SEEK_CUR)
+                        continue
+                    topic = f.read(topic_length).decode()
+                    data = f.read(payload_length)
+                    if len(data) < payload_length:
+                        break
+                    yield Record(offset, timestamp, topic, data if kind == BINARY else data.decode())
+                    start = offset + 1
+                    count += 1
+                    if limit is not None and count >= limit:
+                        return
+
+    # Offset of the first record logged at or after timestamp
+    def offsetAt(self, timestamp: float) -> int:
+        start = self.first_offset
+        for segment in list(self.segments):
+            i = bisect_left(segment.timestamps, timestamp)
+            if i > 0:
+                start = segment.offsets[i - 1]
+            if i < len(segment.timestamps):
+                break
+        for record in self.read(start):
+            if record.timestamp >= timestamp:
+                return record.offset
+        return self.next_offset
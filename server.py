@@ -1,42 +1,490 @@
 import asyncio
 import json
+import logging
+import optparse
+import time
+from collections import deque
+from typing import Dict, Optional, Set
+from urllib.parse import parse_qs
+
 import websockets
 
-clients = {
-    'sender': None,
-    'receiver': None,
-    'sender1': None
+from eventlog import MAX_SEGMENTS, SEGMENT_BYTES, EventLog
+from metrics import setup_logging
+from wire import (SUBPROTOCOL_BINARY, SUBPROTOCOLS, WireError, batch_seq, decode_batch, decode_json,
+                  encode_batch)
+
+# Pub/sub relay between detection processes and simulators/controllers.
+#   ws://host:8765/publish/<topic>    producers, e.g. /publish/intersection1/north
+#   ws://host:8765/subscribe/<topic>  consumers get every message published to <topic>
+#                                     and to the topics below it (/subscribe/ gets all)
+# The old fixed endpoints still work: /sender and /sender1 publish to "detections",
+# /receiver subscribes to everything.
+# Every subscriber has its own bounded queue and send task, so a slow consumer only
+# loses its own oldest messages and never holds up producers or other consumers.
+# Payloads are forwarded as received. Consumers that negotiated the other encoding
+# (see wire.py) get a copy converted once per message; JSON consumers get it
+# wrapped as {"received_from_sender": ...}.
+#
+# Acks: producers get {"response": "Data received"} per message. With ?ack=cumulative
+# they instead get {"response": "Data received", "ack": n} once the first n messages
+# of the connection have been sent to (or dropped by) every subscriber, coalesced
+# into as few replies as the producer reads.
+# Producers that resend unacked batches after a reconnect connect with ?producer=<id>
+# (the same id every time) and number their batches: the binary header's seq, or
+# "seq" in JSON. Batches with a seq the relay already published for that id are
+# acked but not published or logged again.
+#
+# History: every published message is appended to an on-disk log (see eventlog.py).
+# Subscribers can start from the past with query parameters:
+#   ?from=<offset> or ?since=<unix time>  where to start
+#   &speed=max (default)                   as fast as possible, then continue live
+#   &speed=<n>                             at n times the recorded rate, then close
+#   &until=<unix time>                     stop there and close
+# e.g. /subscribe/detections?since=1718000000&speed=1 replays an episode at 1x
+# JSON consumers get the log offset of every message as {..., "offset": n} and can
+# resume after a disconnect with ?from=<n + 1>.
+
+HOST = "localhost"
+PORT = 8765
+SUBSCRIBER_QUEUE_SIZE = 1000  # messages buffered per subscriber, the oldest are dropped when full
+HIGH_WATER = 0.8              # queue fill above which a subscriber counts as slow
+SLOW_CONSUMER_TIMEOUT = 30    # seconds a subscriber may stay slow before it's disconnected
+PING_INTERVAL = 10            # seconds between heartbeats to every peer
+PING_TIMEOUT = 10             # seconds without a pong before a peer is dropped as dead
+SEND_TIMEOUT = 10             # seconds a single send to a subscriber may take before it's dropped as dead
+DEFAULT_TOPIC = "detections"
+EVENT_LOG_DIR = "eventlog"
+REPLAY_BATCH = 1000           # records read from the log at once while replaying
+LEGACY_PATHS = {
+    "/sender": ("publish", DEFAULT_TOPIC),
+    "/sender1": ("publish", DEFAULT_TOPIC),
+    "/receiver": ("subscribe", ""),
 }
 
-async def handler(websocket, path):
-    if path == "/sender":
-        clients['sender'] = websocket
-    elif path == "/receiver":
-        clients['receiver'] = websocket
-    elif path == "/sender1":
-        clients['sender1'] = websocket
-
-    async for message in websocket:
-        data = json.loads(message)
-        print(f"Received data from {path}: {data}")
-
-        # Send received data to the receiver client
-        if clients['receiver']:
-            response = json.dumps({"received_from_sender": data})
-            await clients['receiver'].send(response)
-            print("Sent data to receiver")
-
-        # Send acknowledgment to the sender client
-        if clients['sender'] or clients['sender1']:
-            ack = json.dumps({"response": "Data received"})
-            await clients['sender'].send(ack)
-            print("Sent acknowledgment to sender")
-
-start_server = websockets.serve(handler, "localhost", 8765)
-
-async def main():
-    await start_server
-    print("\033[92mServer started and ready at ws://localhost:8765\033[0m")
-    await asyncio.Future()  # Run forever
-
-asyncio.get_event_loop().run_until_complete(main())
\ No newline at end of file
+log = logging.getLogger("server")
+
+
+# A published payload and its conversions for the other encoding, each made at most
+# once. remaining counts the subscribers that still have to send or drop it.
+class Message:
+    __slots__ = ("payload", "binary", "json", "remaining", "producer", "offset")
+
+    def __init__(self, payload, producer: Optional["Producer"] = None, offset: Optional[int] = None):
+        self.payload = payload
+        self.offset = offset    # in the event log, None when it isn't logged
+        self.binary = payload if isinstance(payload, bytes) else None
+        self.json = None
+        self.remaining = 0
+        self.producer = producer
+
+    def encoded(self, binary: bool):
+        try:
+            if binary:
+                if self.binary is None:
+                    self.binary = encode_batch(decode_json(self.payload))
+                return self.binary
+            if self.json is None:
+                offset = "" if self.offset is None else f', "offset": {self.offset}'
+                if isinstance(self.payload, bytes):
+                    _, _, events = decode_batch(self.payload)
+                    self.json = json.dumps({"received_from_sender": {"detections": events}})[:-1] + offset + '}'
+                else:
+                    # Wrapped without parsing it
+                    self.json = '{"received_from_sender": ' + self.payload + offset + '}'
+            return self.json
+        except (WireError, ValueError, AttributeError) as e:
+            log.warning("Can't convert message for a %s subscriber: %s", "binary" if binary else "JSON", e)
+            return None
+
+    def settle(self):
+        self.remaining -= 1
+        if self.remaining == 0 and self.producer is not None:
+            self.producer.settled()
+
+
+class Subscriber:
+    def __init__(self, websocket, topic: str, max_queue: int = SUBSCRIBER_QUEUE_SIZE):
+        self.websocket = websocket
+        self.topic = topic
+        self.binary = websocket.subprotocol == SUBPROTOCOL_BINARY
+        self.queue = deque()
+        self.max_queue = max_queue
+        self.high_water = max(1, int(max_queue * HIGH_WATER))
+        self.ready = asyncio.Event()
+        self.slow_since = None
+        self.closed = False
+        self.dropped = 0
+
+    # Never blocks the publisher
+    def offer(self, message: Message):
+        if self.closed:
+            message.settle()
+            return
+        if len(self.queue) >= self.high_water:
+            now = time.monotonic()
+            if self.slow_since is None:
+                self.slow_since = now
+                log.warning("Subscriber of '%s' is falling behind (%d queued)", self.topic, len(self.queue))
+            elif now - self.slow_since > SLOW_CONSUMER_TIMEOUT:
+                log.warning("Disconnecting subscriber of '%s', slow for %ds", self.topic, SLOW_CONSUMER_TIMEOUT)
+                self.close()
+                message.settle()
+                asyncio.ensure_future(self.websocket.close(code=1008, reason="Too slow"))
+                return
+        if len(self.queue) >= self.max_queue:
+            self.queue.popleft().settle()
+            self.dropped += 1
+            if self.dropped % 100 == 1:
+                log.warning("Subscriber of '%s' is too slow, %d messages dropped", self.topic, self.dropped)
+        self.queue.append(message)
+        self.ready.set()
+
+    # Releases everything still queued
+    def close(self):
+        self.closed = True
+        while self.queue:
+            self.queue.popleft().settle()
+
+    async def pump(self):
+        try:
+            await self.drain()
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        except asyncio.TimeoutError:
+            log.warning("Disconnecting subscriber of '%s', a send took over %ds", self.topic, SEND_TIMEOUT)
+            self.close()
+            await self.websocket.close(code=1011, reason="Send timeout")
+
+    async def drain(self):
+        while True:
+            await self.ready.wait()
+            if not self.queue:
+                self.ready.clear()
+                continue
+            message = self.queue.popleft()
+            try:
+                payload = message.encoded(self.binary)
+                if payload is not None:
+                    await asyncio.wait_for(self.websocket.send(payload), SEND_TIMEOUT)
+            finally:
+                message.settle()
+            if len(self.queue) < self.high_water // 2:
+                self.slow_since = None
+
+
+# Sends the acks of one producer connection from its own task
+class Producer:
+    def __init__(self, websocket, cumulative: bool, name: Optional[str] = None):
+        self.websocket = websocket
+        self.cumulative = cumulative
+        self.name = name            # stable across reconnects, None when it doesn't dedupe
+        self.received = 0
+        self.outstanding = deque()  # (index, message) not yet settled, oldest first
+        self.acked = 0
+        self.pending_acks = 0
+        self.ready = asyncio.Event()
+
+    def receive(self, payload) -> Message:
+        self.received += 1
+        if not self.cumulative:
+            self.pending_acks += 1
+            self.ready.set()
+            return Message(payload)
+        message = Message(payload, self)
+        self.outstanding.append((self.received, message))
+        return message
+
+    def settled(self):
+        while self.outstanding and self.outstanding[0][1].remaining == 0:
+            self.acked = self.outstanding.popleft()[0]
+        self.ready.set()
+
+    async def pump(self):
+        ack = json.dumps({"response": "Data received"})
+        sent = 0
+        try:
+            while True:
+                await self.ready.wait()
+                self.ready.clear()
+                if self.cumulative:
+                    if self.acked > sent:
+                        sent = self.acked
+                        await self.websocket.send(json.dumps({"response": "Data received", "ack": sent}))
+                    continue
+                while self.pending_acks:
+                    self.pending_acks -= 1
+                    await self.websocket.send(ack)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+
+# "a/b/c" is delivered to subscribers of "a/b/c", "a/b", "a" and ""
+def topic_matches(subscribed: str, topic: str) -> bool:
+    return not subscribed or topic == subscribed or topic.startswith(subscribed + "/")
+
+
+class Broker:
+    def __init__(self, max_queue: int = SUBSCRIBER_QUEUE_SIZE, event_log: Optional[EventLog] = None):
+        self.max_queue = max_queue
+        self.event_log = event_log
+        self.subscribers: Dict[str, Set[Subscriber]] = {}
+        self.published = 0
+        self.last_seq: Dict[str, int] = {}  # highest seq published per producer name
+        self.duplicates = 0
+
+    def subscribe(self, websocket, topic: str) -> Subscriber:
+        subscriber = Subscriber(websocket, topic, self.max_queue)
+        self.subscribers.setdefault(topic, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        subscriber.close()
+        subscribers = self.subscribers.get(subscriber.topic)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self.subscribers[subscriber.topic]
+
+    # Whether the producer sent this batch before and it was published already,
+    # otherwise it's recorded as the producer's latest
+    def seen(self, producer: Producer, payload) -> bool:
+        if producer.name is None:
+            return False
+        seq = batch_seq(payload)
+        if seq is None:
+            return False
+        if seq <= self.last_seq.get(producer.name, -1):
+            self.duplicates += 1
+            return True
+        self.last_seq[producer.name] = seq
+        return False
+
+    # Acked like a published message, without going anywhere
+    def skip(self, message: Message):
+        message.remaining = 1
+        message.settle()
+
+    # Logged and fanned out in one go, so a replay that catches up with the log and
+    # then subscribes neither misses nor repeats a message
+    def publish(self, topic: str, message: Message):
+        self.published += 1
+        if self.event_log is not None:
+            try:
+                message.offset = self.event_log.append(topic, message.payload)
+            except OSError as e:
+                log.error("Can't append to the event log: %s", e)
+        parts = topic.split("/") if topic else []
+        subscribers = [subscriber for i in range(len(parts), -1, -1)
+                       for subscriber in self.subscribers.get("/".join(parts[:i]), ())]
+        # Settled by the last subscriber to send or drop it, or right away without any
+        message.remaining = len(subscribers) + 1
+        for subscriber in subscribers:
+            subscriber.offer(message)
+        message.settle()
+
+
+# Returns (role, topic, query parameters)
+def parse_path(path: str):
+    path, _, query = path.partition("?")
+    params = {name: values[-1] for name, values in parse_qs(query).items()}
+    if path in LEGACY_PATHS:
+        return LEGACY_PATHS[path] + (params,)
+    role, _, topic = path.lstrip("/").partition("/")
+    if role not in ("publish", "subscribe"):
+        return None, None, params
+    return role, topic.strip("/"), params
+
+
+async def serve_publisher(broker: Broker, websocket, topic: str, cumulative: bool, name: Optional[str] = None):
+    producer = Producer(websocket, cumulative, name)
+    acks = asyncio.ensure_future(producer.pump())
+    try:
+        async for message in websocket:
+            log.debug("Received %d bytes for '%s'", len(message), topic)
+            if broker.seen(producer, message):
+                log.debug("Dropped a batch '%s' sent again", name)
+                broker.skip(producer.receive(message))
+            else:
+                broker.publish(topic, producer.receive(message))
+    finally:
+        acks.cancel()
+
+
+# Where a subscriber asked to start in the log, None to only get live messages
+def replay_start(event_log: EventLog, params: dict) -> Optional[int]:
+    if "from" in params:
+        return int(params["from"])
+    if "since" in params:
+        return event_log.offsetAt(float(params["since"]))
+    return None
+
+
+# Sends the logged messages of topic from offset start on. Paced replays (speed is a
+# multiple of the recorded rate) and ones with an end time stop at the end of the log
+# as it was when they started and return False. The others return True once they've
+# caught up, without awaiting anything in between, so the caller can go live gaplessly.
+async def replay(event_log: EventLog, websocket, topic: str, start: int,
+                 speed: Optional[float] = None, until: Optional[float] = None) -> bool:
+    binary = websocket.subprotocol == SUBPROTOCOL_BINARY
+    end = event_log.next_offset if speed or until is not None else None
+    origin = None  # (recorded time, wall clock) of the first replayed message
+    while True:
+        records = list(event_log.read(start, end, REPLAY_BATCH))
+        if not records:
+            return end is None
+        for record in records:
+            start = record.offset + 1
+            if until is not None and record.timestamp > until:
+                return False
+            if not topic_matches(topic, record.topic):
+                continue
+            if speed:
+                if origin is None:
+                    origin = (record.timestamp, time.monotonic())
+                delay = origin[1] + (record.timestamp - origin[0]) / speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            payload = Message(record.payload, offset=record.offset).encoded(binary)
+            if payload is not None:
+                await websocket.send(payload)
+        # Let the producers in between batches of a max speed replay
+        await asyncio.sleep(0)
+
+
+async def serve_subscriber(broker: Broker, websocket, topic: str, params: dict):
+    if broker.event_log is not None:
+        try:
+            start = replay_start(broker.event_log, params)
+            speed = None if params.get("speed", "max") == "max" else float(params["speed"])
+            until = float(params["until"]) if "until" in params else None
+        except ValueError:
+            await websocket.close(code=1008, reason="Invalid replay parameters")
+            return
+        if start is not None or until is not None:
+            start = broker.event_log.first_offset if start is None else start
+            log.info("%s replaying '%s' from offset %d", websocket.remote_address, topic, start)
+            if not await replay(broker.event_log, websocket, topic, start, speed, until):
+                await websocket.close(code=1000, reason="Replay finished")
+                return
+    subscription = broker.subscribe(websocket, topic)
+    pump = asyncio.ensure_future(subscription.pump())
+    try:
+        # Consumers don't send anything, this returns when the connection closes
+        # (or a missed heartbeat closes it)
+        await websocket.wait_closed()
+    finally:
+        broker.unsubscribe(subscription)
+        pump.cancel()
+
+
+def make_handler(broker: Broker):
+    async def handler(websocket, path):
+        role, topic, params = parse_path(path)
+        if role is None:
+            await websocket.close(code=1008, reason=f"Unknown path {path}")
+            return
+        log.info("%s connected to %s '%s'", websocket.remote_address, role, topic)
+        try:
+            if role == "publish":
+                await serve_publisher(broker, websocket, topic, params.get("ack") == "cumulative",
+                                      params.get("producer"))
+            else:
+                await serve_subscriber(broker, websocket, topic, params)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            log.info("%s left %s '%s'", websocket.remote_address, role, topic)
+
+    return handler
+
+
+def get_options():
+    optParser = optparse.OptionParser()
+    optParser.add_option(
+        "--host",
+        dest="host",
+        type="string",
+        default=HOST,
+        help="interface to listen on",
+    )
+    optParser.add_option(
+        "--port",
+        dest="port",
+        type="int",
+        default=PORT,
+        help="port to listen on",
+    )
+    optParser.add_option(
+        "--queue-size",
+        dest="queue_size",
+        type="int",
+        default=SUBSCRIBER_QUEUE_SIZE,
+        help="messages buffered per subscriber before the oldest are dropped",
+    )
+    optParser.add_option(
+        "--ping-interval",
+        dest="ping_interval",
+        type="float",
+        default=PING_INTERVAL,
+        help="seconds between heartbeats",
+    )
+    optParser.add_option(
+        "--ping-timeout",
+        dest="ping_timeout",
+        type="float",
+        default=PING_TIMEOUT,
+        help="seconds without a heartbeat reply before a peer is dropped",
+    )
+    optParser.add_option(
+        "--event-log",
+        dest="event_log",
+        type="string",
+        default=EVENT_LOG_DIR,
+        help="directory of the on-disk event log, empty to not keep one",
+    )
+    optParser.add_option(
+        "--segment-size",
+        dest="segment_size",
+        type="int",
+        default=SEGMENT_BYTES // (1024 * 1024),
+        help="MB per event log segment",
+    )
+    optParser.add_option(
+        "--max-segments",
+        dest="max_segments",
+        type="int",
+        default=MAX_SEGMENTS,
+        help="event log segments kept, the oldest are deleted",
+    )
+    optParser.add_option(
+        "--log-level",
+        dest="log_level",
+        type="choice",
+        choices=["debug", "info", "warning", "error"],
+        default="info",
+        help="log level, debug logs every message",
+    )
+    options, args = optParser.parse_args()
+    return options
+
+
+async def main(options):
+    event_log = None
+    if options.event_log:
+        event_log = EventLog(options.event_log, options.segment_size * 1024 * 1024, options.max_segments)
+        print(f"\033[92mLogging events to {options.event_log}/ from offset {event_log.next_offset}\033[0m")
+    broker = Broker(options.queue_size, event_log)
+    async with websockets.serve(make_handler(broker), options.host, options.port, subprotocols=SUBPROTOCOLS,
+                                ping_interval=options.ping_interval, ping_timeout=options.ping_timeout,
+                                close_timeout=options.ping_timeout):
+        print(f"\033[92mServer started and ready at ws://{options.host}:{options.port}\033[0m")
+        await asyncio.Future()  # Run forever
+
+
+# this is the main entry point of this script
+if __name__ == "__main__":
+    options = get_options()
+    setup_logging(options.log_level)
+    logging.getLogger("websockets").setLevel(logging.WARNING)
+    asyncio.run(main(options))
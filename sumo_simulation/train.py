@@ -3,7 +3,7 @@ from __future__ import print_function
 
 import os
 import sys
-import time
+import itertools
 import optparse
 import random
 import serial  # type: ignore
@@ -380,6 +380,11 @@ def get_options():
     return options
 
 
+# Batched detections add several vehicles within the same instant, so ids can't
+# come from the clock
+vehicle_ids = itertools.count()
+
+
 def add_vehicle(
     direction: Literal["north", "west", "south", "east"],
     turn: Literal["left", "straight", "right"],
@@ -388,26 +393,36 @@ def add_vehicle(
     routeId = routeId + {"north": 0, "west": 1, "south": 2, "east": 3}[direction] * 3
     routeId = routeId + {"left": 0, "straight": 1, "right": 2}[turn]
     print(f"Adding vehicle with routeId: {routeId}")
-    traci.vehicle.add(f"veh_{time.time()}", f"route{routeId}")
+    traci.vehicle.add(f"veh_{next(vehicle_ids)}", f"route{routeId}")
+
+
+# Relay log offset of the last message, to pick up after it after a reconnect
+last_offset = None
 
 
 async def handler(websocket, path):
+    global last_offset
     async for message in websocket:
         data = json.loads(message)
         print(f"Received data from {path}: {data}")
+        last_offset = data.get("offset", last_offset)
         data = data["received_from_sender"]
-        direction = data["direction"]
-        turn = data["turn"]
-        direction = {0: "north", 1: "west", 2: "south", 3: "east"}[direction]
-        turn = {0: "left", 1: "straight", 2: "right"}[turn]
-        add_vehicle(direction, turn)
+        # Senders batch all detections of a frame into one message
+        for detection in data.get("detections", [data]):
+            direction = detection["direction"]
+            turn = detection["turn"]
+            direction = {0: "north", 1: "west", 2: "south", 3: "east"}[direction]
+            turn = {0: "left", 1: "straight", 2: "right"}[turn]
+            add_vehicle(direction, turn)
 
 
 async def receive_message():
     uri = "ws://localhost:8765/receiver"
     while True:
         try:
-            async with websockets.connect(uri) as websocket:
+            # The relay replays what was logged while we were away, then goes live
+            resume = f"{uri}?from={last_offset + 1}" if last_offset is not None else uri
+            async with websockets.connect(resume) as websocket:
                 await handler(websocket, uri)
         except websockets.exceptions.ConnectionClosedError as e:
             print(f"Connection closed: {e}")
@@ -7,16 +7,15 @@
 
 # *** IMAGE XY COOD IS TOP LEFT
 import random
+import heapq
+import itertools
 import math
-import time
-import threading
+import optparse
 # from vehicle_detection import detection
+import numpy as np
 import pygame
 import sys
-import os
-import asyncio
-import websockets
-import json
+import subprocess
 # options={
 #    'model':'./cfg/yolo.cfg',     #specifying the path of model
 #    'load':'./bin/yolov2.weights',   #weights
@@ -37,10 +36,32 @@ noOfSignals = 4
 simTime = 1000       # change this to change time of simulation
 timeElapsed = 0
 
+# The simulation advances in fixed ticks of 1/ticksPerSecond simulated seconds:
+# vehicles move once per tick (speeds are in pixels per tick), signals count down
+# once per second and a vehicle is spawned every spawnInterval seconds. Nothing
+# waits on the wall clock, only the renderer paces it to real time.
+ticksPerSecond = 60
+spawnInterval = 0.75
+tick = 0
+nextSpawnTick = 0
+events = []     # heap of (tick, sequence, action), the sequence keeps same-tick events in order
+eventSequence = itertools.count()
+rng = random.Random()   # seeded for reproducible runs
+verbose = True    # print the signal timers on every phase change
+announce = True   # say the direction that's being detected out loud (macOS)
+
 currentGreen = 0   # Indicates which signal is green
 nextGreen = (currentGreen+1) % noOfSignals
 currentYellow = 0   # Indicates whether yellow signal is on or off
 
+# Signals turn green in the order of phasePlan, which can list a signal more than
+# once or leave one out. Every phase is a green, then a yellow of its signal.
+phasePlan = [0, 1, 2, 3]
+phaseIndex = 0
+greenEndTick = 0    # when the current green ends, then when its yellow ends
+yellowEndTick = 0
+nextGreenTime = None    # green of the next phase set by setTime(), even if it's the same signal
+
 # Average times for vehicles to pass the intersection
 carTime = 2
 bikeTime = 1
@@ -89,6 +110,20 @@ mid = {'right': {'x': 705, 'y': 445}, 'down': {'x': 695, 'y': 450},
        'left': {'x': 695, 'y': 425}, 'up': {'x': 695, 'y': 400}}
 rotationAngle = 3
 
+# Screensize, vehicles that have crossed and then left it are retired
+screenWidth = 1400
+screenHeight = 800
+
+# Per direction number, for the vectorized movement: the axis vehicles travel along
+# (0 x, 1 y) and its sign, the sign along the other axis once they've turned, the
+# offset of every step of a turn, and stopLines and mid along the travel axis
+travelAxis = np.array([0, 1, 0, 1])
+travelSign = np.array([1, 1, -1, -1])
+turnedSign = np.array([1, -1, -1, 1])
+turnStep = np.array([[2, 1.8], [-2.5, 2], [-1.8, -2.5], [1, -1]])
+stopLineAlong = np.array([stopLines[directionNumbers[i]] for i in range(4)])
+midAlong = np.array([mid[directionNumbers[i]]['xy'[travelAxis[i]]] for i in range(4)])
+
 # Gap between vehicles
 gap = 15    # stopping gap
 gap2 = 15   # moving gap
@@ -108,26 +143,190 @@ class TrafficSignal:
         self.totalGreenTime = 0
 
 
+# Images of one vehicle class driving in one direction, loaded once. frames[k] is the
+# image rotated by k*rotationAngle degrees into a turn (up to 90), sizes[k] its size.
+class VehicleSprite:
+    def __init__(self, direction, vehicleClass):
+        path = "images/" + direction + "/" + vehicleClass + ".png"
+        image = pygame.image.load(path)
+        # convert_alpha needs a display, headless runs keep the image as loaded
+        if (pygame.display.get_surface() is not None):
+            image = image.convert_alpha()
+        self.frames = [pygame.transform.rotate(image, -angle)
+                       for angle in range(0, 91, rotationAngle)]
+        self.sizes = [frame.get_size() for frame in self.frames]
+        self.id = len(sprites)
+
+
+sprites = {}    # (direction, vehicleClass) -> VehicleSprite
+
+
+def getSprite(direction, vehicleClass):
+    sprite = sprites.get((direction, vehicleClass))
+    if (sprite is None):
+        sprite = sprites[(direction, vehicleClass)] = VehicleSprite(direction, vehicleClass)
+        traffic.frameSizes = np.array([s.sizes for s in sprites.values()], dtype=float)
+    return sprite
+
+
+# State of every vehicle as arrays indexed by slot, moved all at once by move().
+# Vehicle objects are views of their slot for spawning, the signals and drawing.
+# Slots of retired vehicles are reused, so the arrays only grow to the most
+# vehicles that were ever on the road at once.
+class Traffic:
+    fields = ("pos", "size", "speed", "stop", "active", "crossed", "willTurn", "turned",
+              "frame", "direction", "sprite", "leader")
+
+    def __init__(self, capacity=256):
+        self.count = 0      # slots in use or free, the rest are unused
+        self.free = []
+        self.owners = [None] * capacity     # slot -> Vehicle
+        self.active = np.zeros(capacity, dtype=bool)
+        self.pos = np.zeros((capacity, 2))
+        self.size = np.zeros((capacity, 2))
+        self.speed = np.zeros(capacity)
+        self.stop = np.zeros(capacity)
+        self.crossed = np.zeros(capacity, dtype=bool)
+        self.willTurn = np.zeros(capacity, dtype=bool)
+        self.turned = np.zeros(capacity, dtype=bool)
+        self.frame = np.zeros(capacity, dtype=int)     # rotation step of a turn
+        self.direction = np.zeros(capacity, dtype=int)
+        self.sprite = np.zeros(capacity, dtype=int)
+        self.leader = np.full(capacity, -1)            # slot of the vehicle ahead in the lane
+        self.frameSizes = np.zeros((0, 90 // rotationAngle + 1, 2))  # sprite id, frame -> size
+
+    def grow(self):
+        for name in self.fields:
+            array = getattr(self, name)
+            setattr(self, name, np.concatenate([array, np.zeros_like(array)]))
+        self.owners.extend([None] * len(self.owners))
+
+    def add(self, vehicle, direction_number, sprite, speed, will_turn, leader):
+        if (self.free):
+            slot = self.free.pop()
+        else:
+            if (self.count == len(self.speed)):
+                self.grow()
+            slot = self.count
+            self.count += 1
+        self.owners[slot] = vehicle
+        self.active[slot] = True
+        self.size[slot] = sprite.sizes[0]
+        self.speed[slot] = speed
+        self.crossed[slot] = False
+        self.willTurn[slot] = will_turn
+        self.turned[slot] = False
+        self.frame[slot] = 0
+        self.direction[slot] = direction_number
+        self.sprite[slot] = sprite.id
+        self.leader[slot] = leader
+        return slot
+
+    def remove(self, slot):
+        self.owners[slot] = None
+        self.active[slot] = False
+        self.leader[slot] = -1
+        self.free.append(slot)
+
+    # Slots of the vehicles that have crossed and are now completely off screen
+    def exited(self):
+        n = self.count
+        pos, size = self.pos[:n], self.size[:n]
+        offScreen = (pos[:, 0] > screenWidth) | (pos[:, 0] + size[:, 0] < 0) | \
+            (pos[:, 1] > screenHeight) | (pos[:, 1] + size[:, 1] < 0)
+        return np.flatnonzero(self.active[:n] & self.crossed[:n] & offScreen)
+
+    # How far ahead of each vehicle the back of its leader is along axis
+    def gapAhead(self, axis, sign, leader):
+        rows = np.arange(len(axis))
+        position, size = self.pos[rows, axis], self.size[rows, axis]
+        leaderPosition, leaderSize = self.pos[leader, axis], self.size[leader, axis]
+        front = np.where(sign > 0, position + size, position)
+        back = np.where(sign > 0, leaderPosition, leaderPosition + leaderSize)
+        return sign * (back - front)
+
+    # One tick of every vehicle: a vehicle drives on while it's short of its stop
+    # position, past the stop line or has green, and the one ahead of it in its lane
+    # is far enough ahead or has turned off. Turning vehicles rotate in steps once past
+    # the middle of the intersection and then drive on along the other axis.
+    # Every vehicle sees the others where they were at the start of the tick.
+    def move(self):
+        n = self.count
+        if (n == 0):
+            return
+        rows = np.arange(n)
+        active = self.active[:n]
+        direction = self.direction[:n]
+        axis, sign = travelAxis[direction], travelSign[direction]
+        pos, size, speed = self.pos[:n], self.size[:n], self.speed[:n]
+        crossed, turned, willTurn = self.crossed[:n], self.turned[:n], self.willTurn[:n]
+
+        along = pos[rows, axis]
+        front = np.where(sign > 0, along + size[rows, axis], along)
+        crossing = active & ~crossed & (sign * (front - stopLineAlong[direction]) > 0)
+        if (crossing.any()):
+            crossed |= crossing
+            for i, count in enumerate(np.bincount(direction[crossing], minlength=noOfSignals)):
+                vehicles[directionNumbers[i]]['crossed'] += int(count)
+
+        hasLeader = self.leader[:n] >= 0
+        leader = np.where(hasLeader, self.leader[:n], 0)
+        clear = ~hasLeader | (self.gapAhead(axis, sign, leader) > gap2)
+        green = (direction == currentGreen) & (currentYellow == 0)
+        go = ((sign * (self.stop[:n] - front) >= 0) | crossed | green) & \
+            (clear | (hasLeader & self.turned[leader]))
+        straight = ~willTurn | ~crossed | (sign * (midAlong[direction] - front) > 0)
+        turning = active & ~straight & ~turned
+        turnedGo = active & ~straight & turned & (clear | (self.gapAhead(1 - axis, turnedSign[direction], leader) > gap2))
+
+        moving = active & straight & go
+        pos[rows[moving], axis[moving]] += sign[moving] * speed[moving]
+        pos[rows[turnedGo], 1 - axis[turnedGo]] += turnedSign[direction[turnedGo]] * speed[turnedGo]
+        if (turning.any()):
+            frame = self.frame[:n]
+            frame[turning] += 1
+            pos[turning] += turnStep[direction[turning]]
+            size[turning] = self.frameSizes[self.sprite[:n][turning], frame[turning]]
+            turned |= turning & (frame * rotationAngle >= 90)
+
+
+traffic = Traffic()
+
+
+# A view of one vehicle in traffic
+
+
 class Vehicle(pygame.sprite.Sprite):
     def __init__(self, lane, vehicleClass, direction_number, direction, will_turn):
         pygame.sprite.Sprite.__init__(self)
+        self.spawn(lane, vehicleClass, direction_number, direction, will_turn)
+
+    # Also called on the retired vehicles taken from vehiclePool
+    def spawn(self, lane, vehicleClass, direction_number, direction, will_turn):
         self.lane = lane
         self.vehicleClass = vehicleClass
-        self.speed = speeds[vehicleClass]
         self.direction_number = direction_number
         self.direction = direction
+        self.willTurn = will_turn
+        self.sprite = getSprite(direction, vehicleClass)
+        last = vehicles[direction][lane][-1] if vehicles[direction][lane] else None
+        self.slot = traffic.add(self, direction_number, self.sprite, speeds[vehicleClass], will_turn,
+                                last.slot if last is not None else -1)
+        # At the start of the lane, or queued behind the last vehicle while it's still there
         self.x = x[direction][lane]
         self.y = y[direction][lane]
-        self.crossed = 0
-        self.willTurn = will_turn
-        self.turned = 0
-        self.rotateAngle = 0
+        if (last is not None):
+            if (direction == 'right'):
+                self.x = min(self.x, last.x - self.width - gap)
+            elif (direction == 'left'):
+                self.x = max(self.x, last.x + last.width + gap)
+            elif (direction == 'down'):
+                self.y = min(self.y, last.y - self.height - gap)
+            elif (direction == 'up'):
+                self.y = max(self.y, last.y + last.height + gap)
         vehicles[direction][lane].append(self)
         # self.stop = stops[direction][lane]
         self.index = len(vehicles[direction][lane]) - 1
-        path = "images/" + direction + "/" + vehicleClass + ".png"
-        self.originalImage = pygame.image.load(path)
-        self.currentImage = pygame.image.load(path)
 
         if (direction == 'right'):
             # if more than 1 vehicle in the lane of vehicle before it has crossed stop line
@@ -135,156 +334,118 @@ class Vehicle(pygame.sprite.Sprite):
                 # setting stop coordinate as: stop coordinate of next vehicle - width of next vehicle - gap
                 self.stop = vehicles[direction][lane][self.index-1].stop - \
                     vehicles[direction][lane][self.index -
-                                              1].currentImage.get_rect().width - gap
+                                              1].width - gap
             else:
                 self.stop = defaultStop[direction]
-            # Set new starting and stopping coordinate
-            temp = self.currentImage.get_rect().width + gap
-            x[direction][lane] -= temp
+            # Set new stopping coordinate
+            temp = self.width + gap
             stops[direction][lane] -= temp
         elif (direction == 'left'):
             if (len(vehicles[direction][lane]) > 1 and vehicles[direction][lane][self.index-1].crossed == 0):
                 self.stop = vehicles[direction][lane][self.index-1].stop + \
                     vehicles[direction][lane][self.index -
-                                              1].currentImage.get_rect().width + gap
+                                              1].width + gap
             else:
                 self.stop = defaultStop[direction]
-            temp = self.currentImage.get_rect().width + gap
-            x[direction][lane] += temp
+            temp = self.width + gap
             stops[direction][lane] += temp
         elif (direction == 'down'):
             if (len(vehicles[direction][lane]) > 1 and vehicles[direction][lane][self.index-1].crossed == 0):
                 self.stop = vehicles[direction][lane][self.index-1].stop - \
                     vehicles[direction][lane][self.index -
-                                              1].currentImage.get_rect().height - gap
+                                              1].height - gap
             else:
                 self.stop = defaultStop[direction]
-            temp = self.currentImage.get_rect().height + gap
-            y[direction][lane] -= temp
+            temp = self.height + gap
             stops[direction][lane] -= temp
         elif (direction == 'up'):
             if (len(vehicles[direction][lane]) > 1 and vehicles[direction][lane][self.index-1].crossed == 0):
                 self.stop = vehicles[direction][lane][self.index-1].stop + \
                     vehicles[direction][lane][self.index -
-                                              1].currentImage.get_rect().height + gap
+                                              1].height + gap
             else:
                 self.stop = defaultStop[direction]
-            temp = self.currentImage.get_rect().height + gap
-            y[direction][lane] += temp
+            temp = self.height + gap
             stops[direction][lane] += temp
         simulation.add(self)
 
+    @property
+    def x(self):
+        return float(traffic.pos[self.slot, 0])
+
+    @x.setter
+    def x(self, value):
+        traffic.pos[self.slot, 0] = value
+
+    @property
+    def y(self):
+        return float(traffic.pos[self.slot, 1])
+
+    @y.setter
+    def y(self, value):
+        traffic.pos[self.slot, 1] = value
+
+    @property
+    def stop(self):
+        return float(traffic.stop[self.slot])
+
+    @stop.setter
+    def stop(self, value):
+        traffic.stop[self.slot] = value
+
+    @property
+    def speed(self):
+        return float(traffic.speed[self.slot])
+
+    @property
+    def crossed(self):
+        return int(traffic.crossed[self.slot])
+
+    @property
+    def turned(self):
+        return int(traffic.turned[self.slot])
+
+    @property
+    def rotateAngle(self):
+        return int(traffic.frame[self.slot]) * rotationAngle
+
+    @property
+    def width(self):
+        return float(traffic.size[self.slot, 0])
+
+    @property
+    def height(self):
+        return float(traffic.size[self.slot, 1])
+
+    @property
+    def currentImage(self):
+        return self.sprite.frames[traffic.frame[self.slot]]
+
     def render(self, screen):
         screen.blit(self.currentImage, (self.x, self.y))
 
-    def move(self):
-        if (self.direction == 'right'):
-            # if the image has crossed stop line now
-            if (self.crossed == 0 and self.x+self.currentImage.get_rect().width > stopLines[self.direction]):
-                self.crossed = 1
-                vehicles[self.direction]['crossed'] += 1
-            if (self.willTurn == 1):
-                if (self.crossed == 0 or self.x+self.currentImage.get_rect().width < mid[self.direction]['x']):
-                    if ((self.x+self.currentImage.get_rect().width <= self.stop or (currentGreen == 0 and currentYellow == 0) or self.crossed == 1) and (self.index == 0 or self.x+self.currentImage.get_rect().width < (vehicles[self.direction][self.lane][self.index-1].x - gap2) or vehicles[self.direction][self.lane][self.index-1].turned == 1)):
-                        self.x += self.speed
-                else:
-                    if (self.turned == 0):
-                        self.rotateAngle += rotationAngle
-                        self.currentImage = pygame.transform.rotate(
-                            self.originalImage, -self.rotateAngle)
-                        self.x += 2
-                        self.y += 1.8
-                        if (self.rotateAngle == 90):
-                            self.turned = 1
-                            # path = "images/" + directionNumbers[((self.direction_number+1)%noOfSignals)] + "/" + self.vehicleClass + ".png"
-                            # self.x = mid[self.direction]['x']
-                            # self.y = mid[self.direction]['y']
-                            # self.image = pygame.image.load(path)
-                    else:
-                        if (self.index == 0 or self.y+self.currentImage.get_rect().height < (vehicles[self.direction][self.lane][self.index-1].y - gap2) or self.x+self.currentImage.get_rect().width < (vehicles[self.direction][self.lane][self.index-1].x - gap2)):
-                            self.y += self.speed
-            else:
-                if ((self.x+self.currentImage.get_rect().width <= self.stop or self.crossed == 1 or (currentGreen == 0 and currentYellow == 0)) and (self.index == 0 or self.x+self.currentImage.get_rect().width < (vehicles[self.direction][self.lane][self.index-1].x - gap2) or (vehicles[self.direction][self.lane][self.index-1].turned == 1))):
-                    # (if the image has not reached its stop coordinate or has crossed stop line or has green signal) and (it is either the first vehicle in that lane or it is has enough gap to the next vehicle in that lane)
-                    self.x += self.speed  # move the vehicle
-
-        elif (self.direction == 'down'):
-            if (self.crossed == 0 and self.y+self.currentImage.get_rect().height > stopLines[self.direction]):
-                self.crossed = 1
-                vehicles[self.direction]['crossed'] += 1
-            if (self.willTurn == 1):
-                if (self.crossed == 0 or self.y+self.currentImage.get_rect().height < mid[self.direction]['y']):
-                    if ((self.y+self.currentImage.get_rect().height <= self.stop or (currentGreen == 1 and currentYellow == 0) or self.crossed == 1) and (self.index == 0 or self.y+self.currentImage.get_rect().height < (vehicles[self.direction][self.lane][self.index-1].y - gap2) or vehicles[self.direction][self.lane][self.index-1].turned == 1)):
-                        self.y += self.speed
-                else:
-                    if (self.turned == 0):
-                        self.rotateAngle += rotationAngle
-                        self.currentImage = pygame.transform.rotate(
-                            self.originalImage, -self.rotateAngle)
-                        self.x -= 2.5
-                        self.y += 2
-                        if (self.rotateAngle == 90):
-                            self.turned = 1
-                    else:
-                        if (self.index == 0 or self.x > (vehicles[self.direction][self.lane][self.index-1].x + vehicles[self.direction][self.lane][self.index-1].currentImage.get_rect().width + gap2) or self.y < (vehicles[self.direction][self.lane][self.index-1].y - gap2)):
-                            self.x -= self.speed
-            else:
-                if ((self.y+self.currentImage.get_rect().height <= self.stop or self.crossed == 1 or (currentGreen == 1 and currentYellow == 0)) and (self.index == 0 or self.y+self.currentImage.get_rect().height < (vehicles[self.direction][self.lane][self.index-1].y - gap2) or (vehicles[self.direction][self.lane][self.index-1].turned == 1))):
-                    self.y += self.speed
-
-        elif (self.direction == 'left'):
-            if (self.crossed == 0 and self.x < stopLines[self.direction]):
-                self.crossed = 1
-                vehicles[self.direction]['crossed'] += 1
-            if (self.willTurn == 1):
-                if (self.crossed == 0 or self.x > mid[self.direction]['x']):
-                    if ((self.x >= self.stop or (currentGreen == 2 and currentYellow == 0) or self.crossed == 1) and (self.index == 0 or self.x > (vehicles[self.direction][self.lane][self.index-1].x + vehicles[self.direction][self.lane][self.index-1].currentImage.get_rect().width + gap2) or vehicles[self.direction][self.lane][self.index-1].turned == 1)):
-                        self.x -= self.speed
-                else:
-                    if (self.turned == 0):
-                        self.rotateAngle += rotationAngle
-                        self.currentImage = pygame.transform.rotate(
-                            self.originalImage, -self.rotateAngle)
-                        self.x -= 1.8
-                        self.y -= 2.5
-                        if (self.rotateAngle == 90):
-                            self.turned = 1
-                            # path = "images/" + directionNumbers[((self.direction_number+1)%noOfSignals)] + "/" + self.vehicleClass + ".png"
-                            # self.x = mid[self.direction]['x']
-                            # self.y = mid[self.direction]['y']
-                            # self.currentImage = pygame.image.load(path)
-                    else:
-                        if (self.index == 0 or self.y > (vehicles[self.direction][self.lane][self.index-1].y + vehicles[self.direction][self.lane][self.index-1].currentImage.get_rect().height + gap2) or self.x > (vehicles[self.direction][self.lane][self.index-1].x + gap2)):
-                            self.y -= self.speed
-            else:
-                if ((self.x >= self.stop or self.crossed == 1 or (currentGreen == 2 and currentYellow == 0)) and (self.index == 0 or self.x > (vehicles[self.direction][self.lane][self.index-1].x + vehicles[self.direction][self.lane][self.index-1].currentImage.get_rect().width + gap2) or (vehicles[self.direction][self.lane][self.index-1].turned == 1))):
-                    # (if the image has not reached its stop coordinate or has crossed stop line or has green signal) and (it is either the first vehicle in that lane or it is has enough gap to the next vehicle in that lane)
-                    self.x -= self.speed  # move the vehicle
-            # if((self.x>=self.stop or self.crossed == 1 or (currentGreen==2 and currentYellow==0)) and (self.index==0 or self.x>(vehicles[self.direction][self.lane][self.index-1].x + vehicles[self.direction][self.lane][self.index-1].currentImage.get_rect().width + gap2))):
-            #     self.x -= self.speed
-        elif (self.direction == 'up'):
-            if (self.crossed == 0 and self.y < stopLines[self.direction]):
-                self.crossed = 1
-                vehicles[self.direction]['crossed'] += 1
-            if (self.willTurn == 1):
-                if (self.crossed == 0 or self.y > mid[self.direction]['y']):
-                    if ((self.y >= self.stop or (currentGreen == 3 and currentYellow == 0) or self.crossed == 1) and (self.index == 0 or self.y > (vehicles[self.direction][self.lane][self.index-1].y + vehicles[self.direction][self.lane][self.index-1].currentImage.get_rect().height + gap2) or vehicles[self.direction][self.lane][self.index-1].turned == 1)):
-                        self.y -= self.speed
-                else:
-                    if (self.turned == 0):
-                        self.rotateAngle += rotationAngle
-                        self.currentImage = pygame.transform.rotate(
-                            self.originalImage, -self.rotateAngle)
-                        self.x += 1
-                        self.y -= 1
-                        if (self.rotateAngle == 90):
-                            self.turned = 1
-                    else:
-                        if (self.index == 0 or self.x < (vehicles[self.direction][self.lane][self.index-1].x - vehicles[self.direction][self.lane][self.index-1].currentImage.get_rect().width - gap2) or self.y > (vehicles[self.direction][self.lane][self.index-1].y + gap2)):
-                            self.x += self.speed
-            else:
-                if ((self.y >= self.stop or self.crossed == 1 or (currentGreen == 3 and currentYellow == 0)) and (self.index == 0 or self.y > (vehicles[self.direction][self.lane][self.index-1].y + vehicles[self.direction][self.lane][self.index-1].currentImage.get_rect().height + gap2) or (vehicles[self.direction][self.lane][self.index-1].turned == 1))):
-                    self.y -= self.speed
+    # Takes the vehicle off the road, the one behind it follows the one ahead of it
+    def retire(self):
+        lane = vehicles[self.direction][self.lane]
+        del lane[self.index]
+        for follower in lane[self.index:]:
+            follower.index -= 1
+        if (self.index < len(lane)):
+            traffic.leader[lane[self.index].slot] = lane[self.index-1].slot if self.index > 0 else -1
+        traffic.remove(self.slot)
+        self.kill()
+        vehiclePool.append(self)
+
+
+vehiclePool = []    # retired vehicles, reused by spawnVehicle
+
+
+def spawnVehicle(lane, vehicleClass, direction_number, direction, will_turn):
+    if (vehiclePool):
+        vehicle = vehiclePool.pop()
+        vehicle.spawn(lane, vehicleClass, direction_number, direction, will_turn)
+        return vehicle
+    return Vehicle(lane, vehicleClass, direction_number, direction, will_turn)
 
 # Initialization of signals with default values
 
@@ -302,16 +463,22 @@ def initialize():
     ts4 = TrafficSignal(defaultRed, defaultYellow,
                         defaultGreen, defaultMinimum, defaultMaximum)
     signals.append(ts4)
-    repeat()
+    events.clear()
+    startGreen(0)
 
 # Set time according to formula
 
 
 def setTime():
     global noOfCars, noOfBikes, noOfBuses, noOfTrucks, noOfRickshaws, noOfLanes
-    global carTime, busTime, truckTime, rickshawTime, bikeTime
-    os.system("say detecting vehicles, " +
-              directionNumbers[(currentGreen+1) % noOfSignals])
+    global carTime, busTime, truckTime, rickshawTime, bikeTime, announce
+    if (announce):
+        # In the background, the simulation doesn't wait for it to be said
+        try:
+            subprocess.Popen(["say", "detecting vehicles, " +
+                              directionNumbers[(currentGreen+1) % noOfSignals]])
+        except OSError:
+            announce = False
 #    detection_result=detection(currentGreen,tfnet)
 #    greenTime = math.ceil(((noOfCars*carTime) + (noOfRickshaws*rickshawTime) + (noOfBuses*busTime) + (noOfBikes*bikeTime))/(noOfLanes+1))
 #    if(greenTime<defaultMinimum):
@@ -346,29 +513,54 @@ def setTime():
     greenTime = math.ceil(((noOfCars*carTime) + (noOfRickshaws*rickshawTime) + (
         noOfBuses*busTime) + (noOfTrucks*truckTime) + (noOfBikes*bikeTime))/(noOfLanes+1))
     # greenTime = math.ceil((noOfVehicles)/noOfLanes)
-    print('Green Time: ', greenTime)
+    if (verbose):
+        print('Green Time: ', greenTime)
     if (greenTime < defaultMinimum):
         greenTime = defaultMinimum
     elif (greenTime > defaultMaximum):
         greenTime = defaultMaximum
     # greenTime = random.randint(15,50)
-    signals[(currentGreen+1) % (noOfSignals)].green = greenTime
+    global nextGreenTime
+    signals[nextGreen].green = greenTime
+    nextGreenTime = greenTime
+
+
+# Runs action at the given tick of the simulation clock
+
+
+def schedule(at, action):
+    heapq.heappush(events, (at, next(eventSequence), action))
 
 
-def repeat():
-    global currentGreen, currentYellow, nextGreen
-    # while the timer of current green signal is not zero
-    while (signals[currentGreen].green > 0):
+def runEvents():
+    while (events and events[0][0] <= tick):
+        action = heapq.heappop(events)[2]
+        action()
+
+# Signal controller: every phase change is an event that schedules the next one
+
+
+def startGreen(index):
+    global currentGreen, currentYellow, nextGreen, phaseIndex, greenEndTick, yellowEndTick, nextGreenTime
+    phaseIndex = index
+    currentGreen = phasePlan[index]
+    nextGreen = phasePlan[(index+1) % len(phasePlan)]
+    currentYellow = 0
+    if (nextGreenTime is not None):
+        signals[currentGreen].green = nextGreenTime
+        nextGreenTime = None
+    greenEndTick = tick + signals[currentGreen].green * ticksPerSecond
+    yellowEndTick = greenEndTick + signals[currentGreen].yellow * ticksPerSecond
+    signals[currentGreen].totalGreenTime += signals[currentGreen].green
+    # set time of next green signal, detectionTime before it turns green
+    schedule(max(tick, yellowEndTick - detectionTime * ticksPerSecond), setTime)
+    schedule(greenEndTick, startYellow)
+    if (verbose):
         printStatus()
-        updateValues()
-        # set time of next green signal
-        if (signals[(currentGreen+1) % (noOfSignals)].red == detectionTime):
-            thread = threading.Thread(
-                name="detection", target=setTime, args=())
-            thread.daemon = True
-            thread.start()
-            # setTime()
-        time.sleep(1)
+
+
+def startYellow():
+    global currentYellow
     currentYellow = 1   # set yellow signal on
     vehicleCountTexts[currentGreen] = "0"
     # reset stop coordinates of lanes and vehicles
@@ -377,29 +569,26 @@ def repeat():
               ][i] = defaultStop[directionNumbers[currentGreen]]
         for vehicle in vehicles[directionNumbers[currentGreen]][i]:
             vehicle.stop = defaultStop[directionNumbers[currentGreen]]
-    # while the timer of current yellow signal is not zero
-    while (signals[currentGreen].yellow > 0):
+    schedule(yellowEndTick, endPhase)
+    if (verbose):
         printStatus()
-        updateValues()
-        time.sleep(1)
+
+
+def endPhase():
+    global currentYellow
     currentYellow = 0   # set yellow signal off
 
     # reset all signal times of current signal to default times
     signals[currentGreen].green = defaultGreen
     signals[currentGreen].yellow = defaultYellow
     signals[currentGreen].red = defaultRed
-
-    currentGreen = nextGreen  # set next signal as green signal
-    nextGreen = (currentGreen+1) % noOfSignals    # set next green signal
-    # set the red time of next to next signal as (yellow time + green time) of next signal
-    signals[nextGreen].red = signals[currentGreen].yellow + \
-        signals[currentGreen].green
-    repeat()
+    startGreen((phaseIndex+1) % len(phasePlan))
 
 # Print the signal timers on cmd
 
 
 def printStatus():
+    updateValues()
     for i in range(0, noOfSignals):
         if (i == currentGreen):
             if (currentYellow == 0):
@@ -413,70 +602,92 @@ def printStatus():
                   signals[i].red, " y:", signals[i].yellow, " g:", signals[i].green)
     print()
 
-# Update values of the signal timers after every second
+# Update the signal timers from the scheduled phase changes, for display
 
 
 def updateValues():
-    for i in range(0, noOfSignals):
-        if (i == currentGreen):
-            if (currentYellow == 0):
-                signals[i].green -= 1
-                signals[i].totalGreenTime += 1
-            else:
-                signals[i].yellow -= 1
-        else:
-            signals[i].red -= 1
-
-# Generating vehicles in the simulation
-
-
-def generateVehicles():
-    while (True):
-        vehicle_type = random.randint(0, 4)
-        if (vehicle_type == 4):
-            lane_number = 0
+    def secondsUntil(at):
+        return max(0, math.ceil((at - tick) / ticksPerSecond))
+    if (currentYellow == 0):
+        signals[currentGreen].green = secondsUntil(greenEndTick)
+    else:
+        signals[currentGreen].green = 0
+        signals[currentGreen].yellow = secondsUntil(yellowEndTick)
+    # red until their next turn in the plan, assuming the default times in between
+    start = yellowEndTick
+    seen = {currentGreen}
+    for i in range(1, len(phasePlan)):
+        signal = phasePlan[(phaseIndex+i) % len(phasePlan)]
+        if (signal not in seen):
+            seen.add(signal)
+            signals[signal].red = secondsUntil(start)
+        if (signal == currentGreen):
+            # its timers are counting down the current phase
+            green, yellow = defaultGreen, defaultYellow
         else:
-            lane_number = random.randint(0, 1) + 1
-        will_turn = 0
-        if (lane_number == 2):
-            temp = random.randint(0, 4)
-            if (temp <= 2):
-                will_turn = 1
-            elif (temp > 2):
-                will_turn = 0
-        temp = random.randint(0, 999)
+            green, yellow = signals[signal].green, signals[signal].yellow
+        if (i == 1 and nextGreenTime is not None):
+            green = nextGreenTime
+        start += (green + yellow) * ticksPerSecond
+
+# Generating a random vehicle in the simulation
+
+
+def generateVehicle():
+    vehicle_type = rng.randint(0, 4)
+    if (vehicle_type == 4):
+        lane_number = 0
+    else:
+        lane_number = rng.randint(0, 1) + 1
+    will_turn = 0
+    if (lane_number == 2):
+        temp = rng.randint(0, 4)
+        if (temp <= 2):
+            will_turn = 1
+        elif (temp > 2):
+            will_turn = 0
+    temp = rng.randint(0, 999)
+    direction_number = 0
+    a = [400, 800, 900, 1000]
+    if (temp < a[0]):
         direction_number = 0
-        a = [400, 800, 900, 1000]
-        if (temp < a[0]):
-            direction_number = 0
-        elif (temp < a[1]):
-            direction_number = 1
-        elif (temp < a[2]):
-            direction_number = 2
-        elif (temp < a[3]):
-            direction_number = 3
-        Vehicle(lane_number, vehicleTypes[vehicle_type], direction_number,
-                directionNumbers[direction_number], will_turn)
-        time.sleep(0.75)
-
-
-def simulationTime():
-    global timeElapsed, simTime
-    while (True):
+    elif (temp < a[1]):
+        direction_number = 1
+    elif (temp < a[2]):
+        direction_number = 2
+    elif (temp < a[3]):
+        direction_number = 3
+    spawnVehicle(lane_number, vehicleTypes[vehicle_type], direction_number,
+                 directionNumbers[direction_number], will_turn)
+
+# Advances the simulation by one tick
+
+
+def step():
+    global tick, nextSpawnTick, timeElapsed
+    runEvents()
+    if (tick >= nextSpawnTick):
+        generateVehicle()
+        nextSpawnTick += spawnInterval * ticksPerSecond
+    traffic.move()
+    for slot in traffic.exited():
+        traffic.owners[slot].retire()
+    tick += 1
+    if (tick % ticksPerSecond == 0):
         timeElapsed += 1
-        time.sleep(1)
-        if (timeElapsed == simTime):
-            totalVehicles = 0
-            print('Lane-wise Vehicle Counts')
-            for i in range(noOfSignals):
-                print('Lane', i+1, ':',
-                      vehicles[directionNumbers[i]]['crossed'])
-                totalVehicles += vehicles[directionNumbers[i]]['crossed']
-            print('Total vehicles passed: ', totalVehicles)
-            print('Total time passed: ', timeElapsed)
-            print('No. of vehicles passed per unit time: ',
-                  (float(totalVehicles)/float(timeElapsed)))
-            os._exit(1)
+
+
+def printResults():
+    totalVehicles = 0
+    print('Lane-wise Vehicle Counts')
+    for i in range(noOfSignals):
+        print('Lane', i+1, ':',
+              vehicles[directionNumbers[i]]['crossed'])
+        totalVehicles += vehicles[directionNumbers[i]]['crossed']
+    print('Total vehicles passed: ', totalVehicles)
+    print('Total time passed: ', timeElapsed)
+    print('No. of vehicles passed per unit time: ',
+          (float(totalVehicles)/float(timeElapsed)))
 
 
 # async def generateVehicles(websocket, path):
@@ -534,55 +745,39 @@ def simulationTime():
 #             time.sleep(0.75)
 
 
-def start_websocket_server():
-    asyncio.set_event_loop(asyncio.new_event_loop())
-    asyncio.get_event_loop().run_until_complete(generateVehicles())
-    asyncio.get_event_loop().run_forever()
-
-
-class Main:
-    thread4 = threading.Thread(
-        name="simulationTime", target=simulationTime, args=())
-    thread4.daemon = True
-    thread4.start()
-
-    thread2 = threading.Thread(
-        name="initialization", target=initialize, args=())    # initialization
-    thread2.daemon = True
-    thread2.start()
-
+# Draws the current state of the simulation, attached to it by run()
+class Renderer:
     # Colours
     black = (0, 0, 0)
     white = (255, 255, 255)
 
-    # Screensize
-    screenWidth = 1400
-    screenHeight = 800
     screenSize = (screenWidth, screenHeight)
 
-    # Setting background image i.e. image of intersection
-    background = pygame.image.load('images/mod_int.png')
+    def __init__(self, speed=1):
+        self.screen = pygame.display.set_mode(self.screenSize)
+        pygame.display.set_caption("SIMULATION")
 
-    screen = pygame.display.set_mode(screenSize)
-    pygame.display.set_caption("SIMULATION")
+        # Setting background image i.e. image of intersection
+        self.background = pygame.image.load('images/mod_int.png').convert()
 
-    # Loading signal images and font
-    redSignal = pygame.image.load('images/signals/red.png')
-    yellowSignal = pygame.image.load('images/signals/yellow.png')
-    greenSignal = pygame.image.load('images/signals/green.png')
-    font = pygame.font.Font(None, 30)
+        # Loading signal images and font
+        self.redSignal = pygame.image.load('images/signals/red.png').convert_alpha()
+        self.yellowSignal = pygame.image.load('images/signals/yellow.png').convert_alpha()
+        self.greenSignal = pygame.image.load('images/signals/green.png').convert_alpha()
+        self.font = pygame.font.Font(None, 30)
 
-    thread3 = threading.Thread(
-        name="generateVehicles", target=start_websocket_server, args=())     # Generating vehicles
-    thread3.daemon = True
-    thread3.start()
+        # Frames per wall clock second, 0 draws as fast as possible
+        self.fps = ticksPerSecond * speed
+        self.clock = pygame.time.Clock()
 
-    while True:
+    def draw(self):
+        black, white, screen, font = self.black, self.white, self.screen, self.font
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 sys.exit()
 
-        screen.blit(background, (0, 0))   # display background in simulation
+        screen.blit(self.background, (0, 0))   # display background in simulation
+        updateValues()
         # display signal and set timer according to current status: green, yello, or red
         for i in range(0, noOfSignals):
             if (i == currentGreen):
@@ -591,13 +786,13 @@ class Main:
                         signals[i].signalText = "STOP"
                     else:
                         signals[i].signalText = signals[i].yellow
-                    screen.blit(yellowSignal, signalCoods[i])
+                    screen.blit(self.yellowSignal, signalCoods[i])
                 else:
                     if (signals[i].green == 0):
                         signals[i].signalText = "SLOW"
                     else:
                         signals[i].signalText = signals[i].green
-                    screen.blit(greenSignal, signalCoods[i])
+                    screen.blit(self.greenSignal, signalCoods[i])
             else:
                 if (signals[i].red <= 10):
                     if (signals[i].red == 0):
@@ -606,7 +801,7 @@ class Main:
                         signals[i].signalText = signals[i].red
                 else:
                     signals[i].signalText = "---"
-                screen.blit(redSignal, signalCoods[i])
+                screen.blit(self.redSignal, signalCoods[i])
         signalTexts = ["", "", "", ""]
 
         # display signal timer and vehicle count
@@ -626,9 +821,91 @@ class Main:
         # display the vehicles
         for vehicle in simulation:
             screen.blit(vehicle.currentImage, [vehicle.x, vehicle.y])
-            # vehicle.render(screen)
-            vehicle.move()
         pygame.display.update()
-
-
-Main()
+        if (self.fps):
+            self.clock.tick(self.fps)
+
+
+# Runs the simulation for simTime simulated seconds, drawing every tick when a
+# renderer is attached
+
+
+def run(renderer=None):
+    initialize()
+    while (timeElapsed < simTime):
+        step()
+        if (renderer is not None):
+            renderer.draw()
+
+
+def get_options():
+    optParser = optparse.OptionParser()
+    optParser.add_option(
+        "--nogui",
+        action="store_true",
+        default=False,
+        help="run headless, as fast as possible",
+    )
+    optParser.add_option(
+        "-t",
+        dest="sim_time",
+        type="int",
+        default=simTime,
+        help="simulated seconds to run for",
+    )
+    optParser.add_option(
+        "--seed",
+        dest="seed",
+        type="int",
+        default=None,
+        help="seed of the vehicle generator, for reproducible runs",
+    )
+    optParser.add_option(
+        "--speed",
+        dest="speed",
+        type="float",
+        default=1,
+        help="simulated seconds per second when drawing, 0 for as fast as possible",
+    )
+    optParser.add_option(
+        "--plan",
+        dest="plan",
+        type="string",
+        default=",".join(str(signal) for signal in phasePlan),
+        help="order in which the signals (0-3) turn green, e.g. 0,1,0,2,0,3",
+    )
+    optParser.add_option(
+        "-q",
+        "--quiet",
+        action="store_true",
+        default=False,
+        help="don't print the signal timers",
+    )
+
+    options, args = optParser.parse_args()
+    try:
+        plan = [int(signal) for signal in options.plan.split(",")]
+    except ValueError:
+        plan = None
+    if (not plan or any(signal not in range(noOfSignals) for signal in plan)):
+        optParser.error(f"--plan takes signal numbers from 0 to {noOfSignals-1}, e.g. 0,1,2,3")
+    options.plan = plan
+    return options
+
+
+def main():
+    global simTime, verbose, announce, phasePlan
+    options = get_options()
+    simTime = options.sim_time
+    phasePlan = options.plan
+    rng.seed(options.seed)
+    verbose = not (options.quiet or options.nogui)
+    announce = not options.nogui
+    renderer = None if options.nogui else Renderer(options.speed)
+    run(renderer)
+    printResults()
+
+
+# this is the main entry point of this script
+if __name__ == "__main__":
+    main()
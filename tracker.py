@@ -0,0 +1,135 @@
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+# SORT-style multi-object tracker: a constant velocity Kalman filter per vehicle,
+# matched to new detections by IoU with the Hungarian algorithm.
+# Detections and tracks are (N, 6) arrays:
+#   detections: x1, y1, x2, y2, confidence, class_id
+#   tracks:     x1, y1, x2, y2, track_id, class_id
+
+
+def iou_matrix(boxes_a, boxes_b):
+    x1 = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    y1 = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    x2 = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    y2 = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return intersection / np.maximum(union, 1e-6)
+
+
+# (x1, y1, x2, y2) <-> (center x, center y, area, aspect ratio)
+def box_to_z(box):
+    width = box[2] - box[0]
+    height = box[3] - box[1]
+    return np.array([box[0] + width / 2, box[1] + height / 2, width * height, width / max(height, 1e-6)])
+
+
+def z_to_box(z):
+    width = np.sqrt(max(z[2] * z[3], 0))
+    height = z[2] / max(width, 1e-6)
+    return np.array([z[0] - width / 2, z[1] - height / 2, z[0] + width / 2, z[1] + height / 2])
+
+
+class KalmanBoxTracker:
+    count = 0
+
+    # State is (cx, cy, area, aspect, vx, vy, varea), the aspect ratio is assumed constant
+    F = np.eye(7)
+    F[0, 4] = F[1, 5] = F[2, 6] = 1
+    H = np.eye(4, 7)
+    R = np.diag([1, 1, 10, 10]).astype(float)
+    Q = np.diag([1, 1, 1, 1, 0.01, 0.01, 0.0001])
+
+    def __init__(self, box, class_id):
+        KalmanBoxTracker.count += 1
+        self.id = KalmanBoxTracker.count
+        self.class_id = int(class_id)
+        self.x = np.zeros(7)
+        self.x[:4] = box_to_z(box)
+        self.P = np.diag([10, 10, 10, 10, 10000, 10000, 10000]).astype(float)
+        self.hits = 1
+        self.time_since_update = 0
+
+    def predict(self):
+        # Don't let the area go negative
+        if self.x[2] + self.x[6] <= 0:
+            self.x[6] = 0
+        self.x = self.F @ self.x
+        self.P = self.F @ self.P @ self.F.T + self.Q
+        return self.box()
+
+    def update(self, box, class_id):
+        y = box_to_z(box) - self.H @ self.x
+        S = self.H @ self.P @ self.H.T + self.R
+        K = self.P @ self.H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ y
+        self.P = (np.eye(7) - K @ self.H) @ self.P
+        self.class_id = int(class_id)
+        self.hits += 1
+        self.time_since_update = 0
+
+    def box(self):
+        return z_to_box(self.x)
+
+
+class Sort:
+    def __init__(self, max_age: int = 10, min_hits: int = 3, iou_threshold: float = 0.3):
+        self.max_age = max_age              # detection steps a track survives without a match
+        self.min_hits = min_hits            # matches needed before a track is reported
+        self.iou_threshold = iou_threshold
+        self.trackers = []
+        self.frame_count = 0
+
+    def match(self, detections, predicted):
+        if len(predicted) == 0 or len(detections) == 0:
+            return [], list(range(len(detections))), list(range(len(predicted)))
+        iou = iou_matrix(detections[:, :4], predicted)
+        rows, cols = linear_sum_assignment(-iou)
+        matches = [(row, col) for row, col in zip(rows, cols) if iou[row, col] >= self.iou_threshold]
+        matched_detections = {row for row, _ in matches}
+        matched_tracks = {col for _, col in matches}
+        unmatched_detections = [i for i in range(len(detections)) if i not in matched_detections]
+        unmatched_tracks = [i for i in range(len(predicted)) if i not in matched_tracks]
+        return matches, unmatched_detections, unmatched_tracks
+
+    # Call once per detected frame
+    def update(self, detections):
+        self.frame_count += 1
+        predicted = np.array([tracker.predict() for tracker in self.trackers]).reshape(-1, 4)
+        matches, unmatched_detections, unmatched_tracks = self.match(detections, predicted)
+
+        for row, col in matches:
+            self.trackers[col].update(detections[row, :4], detections[row, 5])
+        for col in unmatched_tracks:
+            self.trackers[col].time_since_update += 1
+        for row in unmatched_detections:
+            self.trackers.append(KalmanBoxTracker(detections[row, :4], detections[row, 5]))
+
+        self.trackers = [tracker for tracker in self.trackers
+                         if tracker.time_since_update <= self.max_age]
+        return self.tracks()
+
+    # Call on frames that skip detection: tracks coast on their velocity
+    def predict(self):
+        for tracker in self.trackers:
+            tracker.predict()
+        return self.tracks()
+
+    # Rows of x1, y1, x2, y2, id, class. float64 keeps ids exact up to 2^53, the id
+    # counter is shared by every stream's tracker
+    def tracks(self):
+        confirmed = [tracker for tracker in self.trackers
+                     if tracker.time_since_update == 0
+                     and (tracker.hits >= self.min_hits or self.frame_count <= self.min_hits)]
+        tracks = np.zeros((len(confirmed), 6), dtype=np.float64)
+        for i, tracker in enumerate(confirmed):
+            tracks[i, :4] = tracker.box()
+            tracks[i, 4] = tracker.id
+            tracks[i, 5] = tracker.class_id
+        return tracks
+
+    def activeIds(self):
+        return {tracker.id for tracker in self.trackers}
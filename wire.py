@@ -0,0 +1,106 @@
+import json
+import struct
+import time
+from typing import List, Optional, Tuple
+
+# Wire format of detection events between car_detection.py, the relay and its consumers.
+# The encoding is negotiated as a websocket subprotocol; peers that don't offer
+# SUBPROTOCOL_BINARY (or offer nothing) get JSON: {"detections": [event, ...]},
+# with "seq": n added when the producer numbers its batches.
+#
+# Binary batch (little endian), one websocket message:
+#   header   version u8, label count u8, seq u32, timestamp f64, event count u16
+#   labels   label count x (length u8, utf-8 bytes)
+#   events   event count x (label index u8, direction u8, lane u8, vehicleClass u8, turn u8)
+
+WIRE_VERSION = 1
+SUBPROTOCOL_BINARY = f"yann.detections.v{WIRE_VERSION}"
+SUBPROTOCOL_JSON = "yann.json"
+SUBPROTOCOLS = [SUBPROTOCOL_BINARY, SUBPROTOCOL_JSON]  # in order of preference
+
+# Append only, the index is what goes over the wire
+VEHICLE_CLASSES = ("car", "bus", "motorcycle", "truck", "rickshaw")
+CLASS_IDS = {name: i for i, name in enumerate(VEHICLE_CLASSES)}
+
+HEADER = struct.Struct("<BBIdH")
+EVENT = struct.Struct("<BBBBB")
+MAX_LABELS = 255
+MAX_EVENTS = 65535
+
+
+class WireError(ValueError):
+    pass
+
+
+def encode_batch(events: List[dict], seq: int = 0, timestamp: Optional[float] = None) -> bytes:
+    if len(events) > MAX_EVENTS:
+        raise WireError(f"{len(events)} events don't fit in one batch")
+    labels = {}
+    body = bytearray()
+    try:
+        for event in events:
+            label = labels.setdefault(event.get("label", ""), len(labels))
+            body += EVENT.pack(label, event["direction"], event["lane"],
+                               CLASS_IDS[event["vehicleClass"]], event["turn"])
+    except (struct.error, KeyError) as e:
+        raise WireError(f"Can't encode event: {e}") from e
+    if len(labels) > MAX_LABELS:
+        raise WireError(f"{len(labels)} labels don't fit in one batch")
+
+    header = bytearray(HEADER.pack(WIRE_VERSION, len(labels), seq & 0xFFFFFFFF,
+                                   time.time() if timestamp is None else timestamp, len(events)))
+    for label in labels:
+        encoded = label.encode()
+        if len(encoded) > 255:
+            raise WireError(f"Label {label!r} is too long")
+        header.append(len(encoded))
+        header += encoded
+    return bytes(header + body)
+
+
+# Returns (seq, timestamp, events)
+def decode_batch(payload: bytes) -> Tuple[int, float, List[dict]]:
+    try:
+        version, label_count, seq, timestamp, event_count = HEADER.unpack_from(payload)
+        if version != WIRE_VERSION:
+            raise WireError(f"Unsupported wire version {version}")
+        offset = HEADER.size
+        labels = []
+        for _ in range(label_count):
+            length = payload[offset]
+            labels.append(payload[offset + 1:offset + 1 + length].decode())
+            offset += 1 + length
+        events = [
+            {"direction": direction, "lane": lane, "vehicleClass": VEHICLE_CLASSES[vehicle_class],
+             "turn": turn, "label": labels[label]}
+            for label, direction, lane, vehicle_class, turn
+            in EVENT.iter_unpack(payload[offset:offset + event_count * EVENT.size])
+        ]
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise WireError(f"Malformed batch: {e}") from e
+    if len(events) != event_count:
+        raise WireError("Truncated batch")
+    return seq, timestamp, events
+
+
+def encode_json(events: List[dict], seq: Optional[int] = None) -> str:
+    if seq is None:
+        return json.dumps({"detections": events})
+    return json.dumps({"detections": events, "seq": seq})
+
+
+# Events of a JSON message, batched or a single event
+def decode_json(payload: str) -> List[dict]:
+    data = json.loads(payload)
+    return data.get("detections", [data])
+
+
+# seq of a batch in either encoding without decoding its events, None when it has none
+def batch_seq(payload) -> Optional[int]:
+    try:
+        if isinstance(payload, bytes):
+            return HEADER.unpack_from(payload)[2]
+        seq = json.loads(payload).get("seq")
+    except (struct.error, ValueError, AttributeError):
+        return None
+    return seq if isinstance(seq, int) else None